@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+# Dimensions des filtres de la page "Statistiques"
+CUBE_DIMENSIONS = ['Nom commune', 'Type bâtiment', 'Type énergie chauffage', 'Type énergie ECS']
+
+# Indicateurs agrégés
+CUBE_MEASURES = ['Consommation totale', 'Consommation chauffage', 'Consommation ECS']
+
+class StatisticsCube:
+    """
+    Cube d'agrégats (effectif, somme, somme des carrés, minimum et maximum) par combinaison de filtres,
+    permettant de calculer les statistiques d'une sélection sans parcourir les données brutes
+    """
+
+    # Constructeur de la classe
+    def __init__(self, df, dimensions=CUBE_DIMENSIONS, measures=CUBE_MEASURES):
+        self.dimensions = dimensions
+        self.measures = measures
+
+        # Les agrégats sont calculés en double précision quel que soit le type des colonnes
+        values = df[measures].astype('float64')
+        squares = (values ** 2).add_suffix(' (carré)')
+        grouped = pd.concat([df[dimensions], values, squares], axis=1).groupby(dimensions, observed=True, dropna=False)
+
+        self.cells = pd.concat({
+            'count': grouped[measures].count(),
+            'sum': grouped[measures].sum(),
+            'sumsq': grouped[squares.columns.tolist()].sum().set_axis(measures, axis=1),
+            'min': grouped[measures].min(),
+            'max': grouped[measures].max()
+        }, axis=1)
+
+    # Fonction de calcul des statistiques des cellules correspondant aux filtres sélectionnés
+    def query(self, filters):
+        mask = np.ones(len(self.cells), dtype=bool)
+        for col, values in filters.items():
+            if values:
+                mask &= self.cells.index.get_level_values(col).isin(values)
+        cells = self.cells[mask]
+
+        stats = {}
+        for col in self.measures:
+            count = cells[('count', col)].sum()
+            total = cells[('sum', col)].sum()
+            sum_squares = cells[('sumsq', col)].sum()
+            variance = (sum_squares - total ** 2 / count) / (count - 1) if count > 1 else np.nan
+            stats[col] = {
+                'moyenne': total / count if count > 0 else np.nan,
+                'écart-type': np.sqrt(max(variance, 0)) if count > 1 else np.nan,
+                'somme': total,
+                'min': cells[('min', col)].min(),
+                'max': cells[('max', col)].max(),
+            }
+        return stats
\ No newline at end of file
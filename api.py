@@ -1,10 +1,153 @@
+from storage import SHARED_MEMORY, MappedColumns, get_storage, migrate_storage, tmp_name
+import features
+from metrics import timed
+
+import json
+import os
+import threading
+import time
 import pandas as pd
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib.parse import quote, unquote
+from urllib3.util.retry import Retry
+
+# URL de l'API des DPE de l'Ademe
+API_URL = "https://data.ademe.fr/data-fair/api/v1/datasets/dpe-v2-logements-existants/lines"
+
+# Filtre sur le département du Rhône (69)
+DEPARTMENT_FILTER = "q=69&q_fields=N%C2%B0_d%C3%A9partement_%28BAN%29"
+
+# Colonnes récupérées pour l'identification des DPE
+DPE_SELECT = "N%C2%B0DPE%2CDate_r%C3%A9ception_DPE"
+
+# Colonnes récupérées pour les données des DPE
+DATA_SELECT = "N%C2%B0DPE%2CP%C3%A9riode_construction%2CSurface_habitable_logement%2CNombre_niveau_logement%2CType_b%C3%A2timent%2CHauteur_sous-plafond%2CType_%C3%A9nergie_principale_chauffage%2CType_%C3%A9nergie_principale_ECS%2CConso_5_usages_%C3%A9_finale%2CConso_chauffage_%C3%A9_finale%2CConso_ECS_%C3%A9_finale%2CClasse_altitude%2CEtiquette_DPE%2CNom__commune_(BAN)%2CCode_postal_(BAN)%2CDate_r%C3%A9ception_DPE%2C_geopoint"
+
+# Les fichiers d'état de l'ingestion sont enregistrés hors du dossier "assets", servi publiquement par Dash
+
+# Fichier du point de reprise de l'ingestion (date de réception la plus récente et N°DPE connus à cette date)
+WATERMARK_PATH = "var/watermark_69.json"
+
+# Fichier d'état d'une récupération complète en cours (partitions déjà enregistrées), supprimé à la fin de la récupération
+BOOTSTRAP_STATE_PATH = "var/bootstrap_69.json"
+
+# Table locale des codes postaux (coordonnées du centre et classe d'altitude), construite à partir des données
+POSTAL_CODES_PATH = "var/postal_codes_69.csv"
+
+# Cache des classes d'altitude obtenues par les API de géocodage et d'altitude
+ALTITUDE_CACHE_PATH = "var/altitude_cache_69.json"
+
+# Utilisation des API de géocodage et d'altitude pour les codes postaux absents de la table locale
+NETWORK_GEOCODING = os.environ.get("NETWORK_GEOCODING", "1") == "1"
+
+# Nombre de lignes par page (maximum autorisé par l'API)
+PAGE_SIZE = 10000
+
+# Tri explicite des lignes (N°DPE est unique) pour que les pages d'une partition soient disjointes et complètes
+SORT = "N%C2%B0DPE"
+
+# Première date de réception des DPE (mise en service du DPE v2), début de la découpe en partitions
+PARTITION_START = "2021-07-01"
+
+# Nombre de mois de dates de réception par partition des requêtes
+PARTITION_MONTHS = int(os.environ.get("API_PARTITION_MONTHS", 1))
+
+# Nombre maximal de requêtes envoyées simultanément
+MAX_WORKERS = int(os.environ.get("API_MAX_WORKERS", 8))
+
+# Longueur maximale de l'URL d'une requête de récupération des données d'une liste de DPE
+MAX_URL_LENGTH = 4000
+
+# Nombre maximal de N°DPE par requête de récupération des données
+MAX_CHUNK_IDS = 500
+
+# Nombre minimal de lignes mises en forme et écrites ensemble lors d'une récupération complète
+FLUSH_ROWS = 50000
+
+# Délais maximaux de connexion et de lecture des requêtes (en secondes)
+TIMEOUT = (10, 120)
+
+# Nombre maximal de tentatives pour une requête
+MAX_RETRIES = 5
+
+# Facteur d'attente exponentielle entre deux tentatives (en secondes)
+BACKOFF_FACTOR = 1
+
+# Codes HTTP considérés comme des erreurs temporaires
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# Correspondance entre les noms des colonnes de l'API et ceux du fichier de données
+COLUMN_NAMES = {
+    "Conso_5_usages_é_finale": "Consommation totale",
+    "Nom__commune_(BAN)": "Nom commune",
+    "Date_réception_DPE": "Date réception DPE",
+    "Conso_ECS_é_finale": "Consommation ECS",
+    "Code_postal_(BAN)": "Code postal",
+    "Hauteur_sous-plafond": "Hauteur sous-plafond",
+    "Surface_habitable_logement": "Surface habitable logement",
+    "Nombre_niveau_logement": "Nombre niveau logement",
+    "Période_construction": "Période construction",
+    "Conso_chauffage_é_finale": "Consommation chauffage",
+    "Type_bâtiment": "Type bâtiment",
+    "Classe_altitude": "Classe altitude",
+    "Type_énergie_principale_ECS": "Type énergie ECS",
+    "Type_énergie_principale_chauffage": "Type énergie chauffage",
+    "Etiquette_DPE": "Étiquette DPE"
+}
 
 class API:
+    # Session HTTP partagée par toutes les instances de la classe
+    _session = None
+    _session_lock = threading.Lock()
+
+    # Table locale des codes postaux et cache des classes d'altitude partagés par toutes les instances de la classe
+    _postal_codes = None
+    _altitude_cache = None
+    _geo_lock = threading.Lock()
+
+    # Constructeur de la classe
+    def __init__(self, max_workers=MAX_WORKERS, timeout=TIMEOUT):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.session = API.get_session()
+
+    # Fonction de création de la session HTTP partagée (connexions persistantes, compression et nouvelles tentatives)
+    @classmethod
+    def get_session(cls):
+        with cls._session_lock:
+            if cls._session is None:
+                retry = Retry(
+                    total=MAX_RETRIES,
+                    backoff_factor=BACKOFF_FACTOR,
+                    status_forcelist=RETRY_STATUS,
+                    allowed_methods=["GET"],
+                    respect_retry_after_header=True,
+                    raise_on_status=False
+                )
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_WORKERS, pool_block=True, max_retries=retry)
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({
+                    "Accept-Encoding": "gzip, deflate",
+                    "User-Agent": "m2-enedis"
+                })
+                cls._session = session
+        return cls._session
+
     # Fonction de récupération d'une page de données
     def get_data_page(self, url):
-        response = requests.get(url)
+        for attempt in range(MAX_RETRIES):
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+                break
+            except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ContentDecodingError, requests.exceptions.ReadTimeout) as e:
+                # Nouvelle tentative sur la même page si la lecture de la réponse est interrompue
+                if attempt == MAX_RETRIES - 1:
+                    raise Exception(f"Erreur lors de la récupération des données : {str(e)}")
+                time.sleep(BACKOFF_FACTOR * 2 ** attempt)
 
         # Récupération des données de la page
         if response.status_code == 200:
@@ -12,50 +155,275 @@ class API:
         else:
             raise Exception(f"Erreur lors de la récupération des données : [{response.status_code}] {response.text}")
 
+    # Fonction de découpage des dates de réception en partitions disjointes [début, fin] de PARTITION_MONTHS mois,
+    # la première et la dernière étant ouvertes (None) pour couvrir toutes les dates
+    def date_partitions(self, start_date=None):
+        months = pd.period_range(pd.Period(start_date or PARTITION_START, freq="M"), pd.Period.now(freq="M"), freq="M")
+        partitions = [] if len(months) else [[None, None]]
+        for i in range(0, len(months), PARTITION_MONTHS):
+            first, last = months[i], months[min(i + PARTITION_MONTHS, len(months)) - 1]
+            partitions.append([first.start_time.strftime("%Y-%m-%d"), last.end_time.strftime("%Y-%m-%d")])
+        partitions[0][0] = start_date
+        partitions[-1][1] = None
+        return partitions
+
+    # Fonction de construction de l'URL de la première page d'une partition (filtre sur la date de réception et tri explicite)
+    def partition_url(self, url, partition):
+        low, high = partition
+        date_filter = quote(f"Date_réception_DPE:[{low or '*'} TO {high or '*'}]")
+        return f"{url}&qs={date_filter}&sort={SORT}&size={PAGE_SIZE}"
+
+    # Fonction de récupération de l'ensemble des lignes d'une partition, en suivant le lien "next" de chaque page
+    # (l'API refuse les pages numérotées au-delà des 10000 premiers résultats)
+    def get_partition(self, url, partition):
+        page = self.get_data_page(self.partition_url(url, partition))
+        rows = page["results"]
+        while page.get("next") and page["results"]:
+            page = self.get_data_page(page["next"])
+            rows.extend(page["results"])
+        return rows
+
+    # Fonction de récupération des partitions d'une requête en parallèle, renvoyées dans leur ordre avec leur position :
+    # seules les partitions suivant la prochaine à renvoyer sont récupérées, dans la limite du nombre de workers
+    def iter_partitions(self, url, partitions):
+        futures = {}
+        submitted = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for position in range(len(partitions)):
+                while submitted < len(partitions) and submitted < position + self.max_workers:
+                    futures[submitted] = executor.submit(self.get_partition, url, partitions[submitted])
+                    submitted += 1
+                yield position, futures.pop(position).result()
+
+    # Fonction de récupération de l'ensemble des lignes d'une requête, éventuellement à partir d'une date de réception
+    def get_all_rows(self, url, start_date=None):
+        all_rows = []
+        for _, rows in self.iter_partitions(url, self.date_partitions(start_date)):
+            all_rows.extend(rows)
+
+        # Suppression des doublons éventuels (DPE modifiés pendant la récupération)
+        all_rows = pd.DataFrame(all_rows)
+        if "N°DPE" in all_rows.columns:
+            all_rows = all_rows.drop_duplicates(subset="N°DPE").reset_index(drop=True)
+
+        return all_rows
+
+    # Fonction de construction de l'URL de récupération des données d'une liste de DPE
+    def detail_url(self, chunk):
+        dpe_str = '%2C'.join(quote(str(dpe)) for dpe in chunk)
+        return f"{API_URL}?size={PAGE_SIZE}&q={dpe_str}&q_fields=N%C2%B0DPE&select={DATA_SELECT}"
+
+    # Fonction de découpage d'une liste de DPE en blocs dont l'URL ne dépasse pas la longueur maximale
+    def detail_chunks(self, dpe_list):
+        base_length = len(self.detail_url([]))
+        chunks, chunk, length = [], [], base_length
+        for dpe in dpe_list:
+            dpe_length = len(quote(str(dpe))) + 3
+            if chunk and (length + dpe_length > MAX_URL_LENGTH or len(chunk) >= MAX_CHUNK_IDS):
+                chunks.append(chunk)
+                chunk, length = [], base_length
+            chunk.append(dpe)
+            length += dpe_length
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    # Fonction de récupération en parallèle des données d'une liste de DPE, les blocs en échec étant réessayés un par un
+    def fetch_details(self, dpe_list):
+        chunks = self.detail_chunks(dpe_list)
+        all_data, failed_chunks = [], []
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.get_data_page, self.detail_url(chunk)): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                try:
+                    all_data.extend(future.result()["results"])
+                except Exception as e:
+                    print(f"Échec d'un bloc de {len(futures[future])} DPE : {str(e)}")
+                    failed_chunks.append(futures[future])
+
+        # Nouvelle tentative de chaque bloc en échec, une fois la file terminée
+        failed_ids = []
+        for chunk in failed_chunks:
+            try:
+                all_data.extend(self.get_data_page(self.detail_url(chunk))["results"])
+            except Exception as e:
+                print(f"Nouvel échec d'un bloc de {len(chunk)} DPE : {str(e)}")
+                failed_ids.extend(chunk)
+
+        print(f"Récupération terminée : {len(chunks)} blocs, {len(failed_chunks)} réessayés, {len(failed_ids)} DPE en échec")
+        return all_data, failed_ids
+
+    # Fonction de mise en forme des données récupérées
+    def format_data(self, all_data):
+        # Ajout des colonnes absentes d'une page (l'API n'envoie pas les champs vides)
+        fields = unquote(DATA_SELECT).split(",")
+        all_data = all_data.drop(columns=["_score"], errors="ignore")
+        all_data = all_data.reindex(columns=[*all_data.columns, *(f for f in fields if f not in all_data.columns)])
+
+        coordinates = all_data["_geopoint"].astype("string").str.split(",", expand=True).reindex(columns=[0, 1])
+        all_data[["Latitude", "Longitude"]] = coordinates.to_numpy()
+        all_data = all_data.drop(columns=["_geopoint"])
+        all_data["Date_réception_DPE"] = all_data["Date_réception_DPE"].astype("string").str.replace("-", "")
+        all_data["Date_réception_DPE_graph"] = all_data["Date_réception_DPE"].str[:6]
+        return all_data.rename(columns=COLUMN_NAMES)
+
     # Fonction de récupération des données
+    @timed("api.get_data")
     def get_data(self):
-        print("Détection des nouveaux DPE en cours...")
-        all_dpe = []
-        page_number = 1 
+        # Aucune donnée n'est enregistrée si une page reste inaccessible après toutes les tentatives
+        try:
+            self.update_data()
+        except Exception as e:
+            print(f"Erreur lors du traitement : {str(e)}")
 
-        # Identification des nouveaux DPE
-        while True:
-            try:
-                if page_number == 1:
-                    dpe = self.get_data_page("https://data.ademe.fr/data-fair/api/v1/datasets/dpe-v2-logements-existants/lines?size=10000&q=69&q_fields=N%C2%B0_d%C3%A9partement_%28BAN%29&select=N%C2%B0DPE%2CDate_r%C3%A9ception_DPE")
-                else:
-                    dpe = self.get_data_page(url)
+    # Fonction de chargement du point de reprise de l'ingestion
+    def load_watermark(self, storage):
+        if os.path.exists(WATERMARK_PATH):
+            with open(WATERMARK_PATH, encoding="utf-8") as f:
+                watermark = json.load(f)
+            return watermark["date"], set(watermark["ids"])
 
-                # Ajout des données
-                all_dpe.extend(dpe["results"])
-                
-                # Récupération de l'URL de la page suivante
-                url = dpe.get("next")
-                if not url:
-                    break
+        # Reconstruction du point de reprise à partir des données existantes
+        df = storage.load(columns=["Date réception DPE", "N°DPE"] if "N°DPE" in storage.columns() else ["Date réception DPE"])
+        return self.compute_watermark(df, "Date réception DPE")
 
-                page_number += 1
-            except Exception as e:
-                print(f"Erreur lors du traitement : {str(e)}")
-                break
+    # Fonction de calcul du point de reprise : date de réception la plus récente et N°DPE reçus à cette date
+    def compute_watermark(self, df, date_col, previous=None):
+        dates = df[date_col].dropna().astype("int64").astype(str)
+        if dates.empty:
+            return previous
+        max_date = dates.max()
+        ids = set(df.loc[dates[dates == max_date].index, "N°DPE"]) if "N°DPE" in df.columns else set()
 
-        # Transformation des données en DataFrame
-        all_dpe = pd.DataFrame(all_dpe)
+        # Conservation des N°DPE déjà connus si la date n'a pas changé
+        if previous is not None and previous[0] == max_date:
+            ids |= previous[1]
+        elif previous is not None and previous[0] > max_date:
+            return previous
+        return max_date, ids
 
-        # Mise en forme des données
-        all_dpe = all_dpe.drop(columns=["_score"])
-        all_dpe["Date_réception_DPE"] = all_dpe["Date_réception_DPE"].str.replace("-", "")
+    # Fonction de calcul du point de reprise lorsque des DPE n'ont pas pu être récupérés :
+    # date du plus ancien DPE en échec et N°DPE déjà enregistrés depuis cette date
+    def hold_back_watermark(self, all_dpe, all_data, failed_ids, previous):
+        dates = all_dpe.set_index("N°DPE")["Date_réception_DPE"].str.replace("-", "")
+        retry_date = dates.loc[failed_ids].min()
+        added = dates.loc[all_data["N°DPE"]]
+        ids = set(added[added >= retry_date].index)
+        if previous[0] == retry_date:
+            ids |= previous[1]
+        return retry_date, ids
 
-        # Si des données sont déjà présentes
+    # Fonction de sauvegarde du point de reprise de l'ingestion
+    def save_watermark(self, watermark):
+        os.makedirs(os.path.dirname(WATERMARK_PATH), exist_ok=True)
+        tmp_path = tmp_name(WATERMARK_PATH)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"date": watermark[0], "ids": sorted(watermark[1])}, f)
+        os.replace(tmp_path, WATERMARK_PATH)
+
+    # Fonction de chargement de l'état d'une récupération complète interrompue
+    def load_bootstrap_state(self):
         try:
-            all_data = []
-            df = pd.read_csv("assets/data_69.csv", sep="|")
-            
-            # Récupération de la date des DPE les plus récents
-            max_date = df["Date réception DPE"].max()
+            with open(BOOTSTRAP_STATE_PATH, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    # Fonction de sauvegarde de l'état d'une récupération complète
+    def save_bootstrap_state(self, state):
+        os.makedirs(os.path.dirname(BOOTSTRAP_STATE_PATH), exist_ok=True)
+        tmp_path = tmp_name(BOOTSTRAP_STATE_PATH)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, BOOTSTRAP_STATE_PATH)
+
+    # Fonction de récupération des données mises en forme par blocs de partitions, avec les positions des partitions de chaque bloc
+    def iter_chunks(self, url, partitions, done=()):
+        rows, positions = [], []
+        todo = [(position, partition) for position, partition in enumerate(partitions) if position not in done]
+        for i, partition_rows in self.iter_partitions(url, [partition for _, partition in todo]):
+            rows.extend(partition_rows)
+            positions.append(todo[i][0])
+            if len(rows) >= FLUSH_ROWS:
+                yield positions, self.format_data(pd.DataFrame(rows))
+                rows, positions = [], []
+        if positions:
+            yield positions, self.format_data(pd.DataFrame(rows)) if rows else None
+
+    # Fonction de récupération complète des données, écrites bloc par bloc et reprise aux partitions non enregistrées si elle a été interrompue
+    def bootstrap_data(self, storage):
+        state = self.load_bootstrap_state()
+        # Les blocs sont ajoutés aux données lors d'une reprise, le premier bloc remplace les données sinon
+        appending = state is not None and "partitions" in state and storage.exists()
+        if appending:
+            print(f"Reprise de la récupération : {len(state['partitions']) - len(state['done'])} partitions restantes ({state['rows']} DPE déjà enregistrés)...")
+            seen_ids = set(storage.load(columns=["N°DPE"])["N°DPE"])
+        else:
+            print("Aucune donnée présente : récupération de l'ensemble des DPE, cela peut prendre un moment...")
+            # Les partitions sont fixées au début de la récupération pour qu'une reprise porte sur les mêmes dates
+            state = {"partitions": self.date_partitions(), "done": [], "rows": 0}
+            seen_ids = set()
+
+        # L'état est enregistré avant la première écriture pour que des données partielles ne soient pas considérées comme complètes
+        self.save_bootstrap_state(state)
+
+        url = f"{API_URL}?{DEPARTMENT_FILTER}&select={DATA_SELECT}"
+        for positions, chunk in self.iter_chunks(url, state["partitions"], set(state["done"])):
+            added = 0
+            if chunk is not None:
+                # Suppression des doublons éventuels entre les partitions
+                chunk = chunk.drop_duplicates(subset="N°DPE")
+                chunk = chunk[~chunk["N°DPE"].isin(seen_ids)]
+                seen_ids.update(chunk["N°DPE"])
+                added = len(chunk)
+
+                if appending:
+                    storage.append(chunk)
+                else:
+                    storage.save(chunk)
+                    appending = True
+            state = {"partitions": state["partitions"], "done": state["done"] + positions, "rows": state["rows"] + added}
+            self.save_bootstrap_state(state)
+            print(f"{state['rows']} DPE enregistrés ({len(state['done'])}/{len(state['partitions'])} partitions)")
+
+        # Point de reprise de l'ingestion calculé à partir des données enregistrées
+        df = storage.load(columns=["Date réception DPE", "N°DPE"])
+        self.save_watermark(self.compute_watermark(df, "Date réception DPE"))
+        os.remove(BOOTSTRAP_STATE_PATH)
+        self.publish_data(storage, rewrite=True)
+
+        print(f"{state['rows']} DPE ajoutés")
+
+    # Fonction de publication des données : table des codes postaux, données en mémoire partagée pour les workers,
+    # puis nouvelle version des données, écrite en dernier pour que les workers ne rechargent qu'une fois tout construit
+    def publish_data(self, storage, rewrite=False):
+        self.build_postal_codes(storage)
+        if SHARED_MEMORY:
+            MappedColumns().refresh(storage)
+        storage.publish(rewrite)
+
+    # Fonction de mise à jour du fichier de données
+    @timed("api.update_data")
+    def update_data(self):
+        migrate_storage()
+        storage = get_storage()
+
+        # Si des données complètes sont déjà présentes
+        if storage.exists() and self.load_bootstrap_state() is None:
+            watermark = self.load_watermark(storage)
+            max_date, known_ids = watermark
+
+            # Identification des DPE reçus depuis le point de reprise, filtrés côté serveur
+            print("Détection des nouveaux DPE en cours...")
+            all_dpe = self.get_all_rows(f"{API_URL}?{DEPARTMENT_FILTER}&select={DPE_SELECT}", f"{max_date[:4]}-{max_date[4:6]}-{max_date[6:]}")
             
-            # Filtrage des nouveaux DPE
-            all_dpe = all_dpe[all_dpe["Date_réception_DPE"] > str(max_date)]
+            # Suppression des DPE déjà connus à la date du point de reprise (ou de toute cette date si les N°DPE ne sont pas connus)
+            if not all_dpe.empty:
+                if known_ids:
+                    all_dpe = all_dpe[~all_dpe["N°DPE"].isin(known_ids)]
+                else:
+                    all_dpe = all_dpe[all_dpe["Date_réception_DPE"].str.replace("-", "") > max_date]
             
             # Si aucun nouveau DPE n'est trouvé, arrêt de la fonction
             if all_dpe.empty:
@@ -66,107 +434,30 @@ class API:
             
             # Récupération de tous les N°DPE
             dpe_list = all_dpe["N°DPE"].tolist()
-            
-            # Division de la liste en chunks de 500
-            for i in range(0, len(dpe_list), 100):
-                chunk = dpe_list[i:i + 100]
-                dpe_str = '%2C'.join(map(str, chunk))
-                try :
-                    data = self.get_data_page(f"https://data.ademe.fr/data-fair/api/v1/datasets/dpe-v2-logements-existants/lines?size=10000&q={dpe_str}&q_fields=N%C2%B0DPE&select=P%C3%A9riode_construction%2CSurface_habitable_logement%2CNombre_niveau_logement%2CType_b%C3%A2timent%2CHauteur_sous-plafond%2CType_%C3%A9nergie_principale_chauffage%2CType_%C3%A9nergie_principale_ECS%2CConso_5_usages_%C3%A9_finale%2CConso_chauffage_%C3%A9_finale%2CConso_ECS_%C3%A9_finale%2CClasse_altitude%2CEtiquette_DPE%2CNom__commune_(BAN)%2CCode_postal_(BAN)%2CDate_r%C3%A9ception_DPE%2C_geopoint")
-                    
-                    # Ajout des données
-                    all_data.extend(data["results"])
-                except Exception as e:
-                    print(f"Erreur lors du traitement : {str(e)}")
-                    break  
-
-            # Transformation des données en DataFrame
-            all_data = pd.DataFrame(all_data)
-
-            # Mise en forme des données
-            all_data = all_data.drop(columns=["_score"])
-            all_data[["Latitude", "Longitude"]] = all_data["_geopoint"].str.split(",", expand=True)
-            all_data = all_data.drop(columns=["_geopoint"])
-            all_data["Date_réception_DPE"] = all_data["Date_réception_DPE"].str.replace("-", "")
-            all_data["Date_réception_DPE_graph"] = all_data["Date_réception_DPE"].str[:6]
-            all_data = all_data.rename(columns={
-                "Conso_5_usages_é_finale": "Consommation totale",
-                "Nom__commune_(BAN)": "Nom commune",
-                "Date_réception_DPE": "Date réception DPE",
-                "Conso_ECS_é_finale": "Consommation ECS",
-                "Code_postal_(BAN)": "Code postal",
-                "Hauteur_sous-plafond": "Hauteur sous-plafond",
-                "Surface_habitable_logement": "Surface habitable logement",
-                "Nombre_niveau_logement": "Nombre niveau logement",
-                "Période_construction": "Période construction",
-                "Conso_chauffage_é_finale": "Consommation chauffage",
-                "Type_bâtiment": "Type bâtiment",
-                "Classe_altitude": "Classe altitude",
-                "Type_énergie_principale_ECS": "Type énergie ECS",
-                "Type_énergie_principale_chauffage": "Type énergie chauffage",
-                "Etiquette_DPE": "Étiquette DPE"
-                })
-            
-            # Ajout des nouvelles données au fichier data_69.csv
-            all_data.to_csv("assets/data_69.csv", index=False, sep="|", encoding="utf-8", mode="a", header=False)
+            all_data, failed_ids = self.fetch_details(dpe_list)
+            if not all_data:
+                print(f"Aucun DPE récupéré, {len(failed_ids)} DPE en échec")
+                return
 
-            print(f"{len(dpe_list)} DPE ajoutés")
-            
-        except FileNotFoundError:
-            # Récupération des données complètes si le fichier n'existe pas
-            while True:
-                try:
-                    if page_number == 1:
-                        data = self.get_data_page("https://data.ademe.fr/data-fair/api/v1/datasets/dpe-v2-logements-existants/lines?size=10000&q=69&q_fields=N%C2%B0_d%C3%A9partement_%28BAN%29&select=P%C3%A9riode_construction%2CSurface_habitable_logement%2CNombre_niveau_logement%2CType_b%C3%A2timent%2CHauteur_sous-plafond%2CType_%C3%A9nergie_principale_chauffage%2CType_%C3%A9nergie_principale_ECS%2CConso_5_usages_%C3%A9_finale%2CConso_chauffage_%C3%A9_finale%2CConso_ECS_%C3%A9_finale%2CClasse_altitude%2CEtiquette_DPE%2CNom__commune_(BAN)%2CCode_postal_(BAN)%2CDate_r%C3%A9ception_DPE%2C_geopoint")
-                        total_rows = data.get("total")
-                        print(f"{len(total_rows)} nouveaux DPE trouvés : récupération des données en cours, cela peut prendre un moment...")
-                    else:
-                        data = self.get_data_page(url)
-
-                    # Ajout des données
-                    all_data.extend(data["results"])
-                    
-                    # Récupération de l'URL de la page suivante
-                    url = data.get("next")
-                    if not url:
-                        break
-
-                    page_number += 1
-                except Exception as e:
-                    print(f"Erreur lors du traitement : {str(e)}")
-                    break
-
-            # Transformation des données en DataFrame
-            all_data = pd.DataFrame(all_data)
-
-            # Mise en forme des données
-            all_data = all_data.drop(columns=["_score"])
-            all_data[["Latitude", "Longitude"]] = all_data["_geopoint"].str.split(",", expand=True)
-            all_data = all_data.drop(columns=["_geopoint"])
-            all_data["Date_réception_DPE"] = all_data["Date_réception_DPE"].str.replace("-", "")
-            all_data["Date_réception_DPE_graph"] = all_data["Date_réception_DPE"].str[:6]
-            all_data = all_data.rename(columns={
-                "Conso_5_usages_é_finale": "Consommation totale",
-                "Nom__commune_(BAN)": "Nom commune",
-                "Date_réception_DPE": "Date réception DPE",
-                "Conso_ECS_é_finale": "Consommation ECS",
-                "Code_postal_(BAN)": "Code postal",
-                "Hauteur_sous-plafond": "Hauteur sous-plafond",
-                "Surface_habitable_logement": "Surface habitable logement",
-                "Nombre_niveau_logement": "Nombre niveau logement",
-                "Période_construction": "Période construction",
-                "Conso_chauffage_é_finale": "Consommation chauffage",
-                "Type_bâtiment": "Type bâtiment",
-                "Classe_altitude": "Classe altitude",
-                "Type_énergie_principale_ECS": "Type énergie ECS",
-                "Type_énergie_principale_chauffage": "Type énergie chauffage",
-                "Etiquette_DPE": "Étiquette DPE"
-                })
-            
-            # Sauvegarde des données en CSV
-            all_data.to_csv("assets/data_69.csv", index=False, sep="|", encoding="utf-8")
+            # Transformation et mise en forme des données
+            all_data = self.format_data(pd.DataFrame(all_data))
+            all_data = all_data[all_data["N°DPE"].isin(dpe_list)].drop_duplicates(subset="N°DPE")
+
+            # Ajout des nouvelles données aux données existantes
+            storage.append(all_data)
+            if failed_ids:
+                # Le point de reprise est ramené à la date du plus ancien DPE en échec pour qu'il soit récupéré à la prochaine mise à jour
+                self.save_watermark(self.hold_back_watermark(all_dpe, all_data, failed_ids, watermark))
+            else:
+                self.save_watermark(self.compute_watermark(all_data, "Date réception DPE", watermark))
+            self.publish_data(storage)
 
-            print(f"{total_rows} DPE ajoutés")
+            missing = len(dpe_list) - len(all_data) - len(failed_ids)
+            print(f"{len(all_data)} DPE ajoutés sur {len(dpe_list)} ({len(failed_ids)} en échec, {missing} introuvables)")
+            
+        else:
+            # Récupération des données complètes si aucune donnée n'est présente ou si la récupération a été interrompue
+            self.bootstrap_data(storage)
 
     # Fonction de récupération des coordonnées géographiques d'un code postal
     def get_coordinates(self, code_postal):
@@ -179,7 +470,7 @@ class API:
         headers = {
             'User-Agent': 'm2-enedis'
         }
-        response = requests.get(url, params=params, headers=headers)
+        response = self.session.get(url, params=params, headers=headers, timeout=self.timeout)
         if response.status_code == 200:
             data = response.json()
             if data:
@@ -187,14 +478,100 @@ class API:
         return None, None
 
     # Fonction de récupération de l'altitude d'un point géographique
-    def get_altitude(lat, lon):
+    def get_altitude(self, lat, lon):
         url = 'https://api.open-elevation.com/api/v1/lookup'
         params = {
             'locations': f'{lat},{lon}'
         }
-        response = requests.get(url, params=params)
+        response = self.session.get(url, params=params, timeout=self.timeout)
         if response.status_code == 200:
             data = response.json()
             if 'results' in data and len(data['results']) > 0:
                 return data['results'][0]['elevation']
-        return None
\ No newline at end of file
+        return None
+
+    # Fonction de construction de la table locale des codes postaux à partir des coordonnées et des classes d'altitude des DPE
+    def build_postal_codes(self, storage):
+        df = storage.load(columns=["Code postal", "Latitude", "Longitude", "Classe altitude"]).dropna(subset=["Code postal"])
+        df["Code postal"] = df["Code postal"].astype("int64")
+
+        # Coordonnées du centre de chaque code postal
+        table = df.groupby("Code postal")[["Latitude", "Longitude"]].median()
+
+        # Classe d'altitude la plus fréquente de chaque code postal
+        counts = df.groupby(["Code postal", "Classe altitude"], observed=True).size().reset_index(name="count")
+        counts = counts.sort_values("count").drop_duplicates(subset="Code postal", keep="last")
+        table["Classe altitude"] = counts.set_index("Code postal")["Classe altitude"].astype(object)
+
+        os.makedirs(os.path.dirname(POSTAL_CODES_PATH), exist_ok=True)
+        tmp_path = tmp_name(POSTAL_CODES_PATH)
+        table.reset_index().to_csv(tmp_path, index=False, sep="|", encoding="utf-8")
+        os.replace(tmp_path, POSTAL_CODES_PATH)
+
+    # Fonction de chargement de la table locale des codes postaux, rechargée si elle a été reconstruite
+    def get_postal_codes(self):
+        if not os.path.exists(POSTAL_CODES_PATH):
+            # Construction de la table à la première utilisation si des données sont présentes
+            storage = get_storage()
+            if not storage.exists():
+                return pd.DataFrame(columns=["Latitude", "Longitude", "Classe altitude"])
+            self.build_postal_codes(storage)
+
+        mtime = os.stat(POSTAL_CODES_PATH).st_mtime_ns
+        if API._postal_codes is None or API._postal_codes[0] != mtime:
+            with API._geo_lock:
+                API._postal_codes = (mtime, pd.read_csv(POSTAL_CODES_PATH, sep="|", index_col="Code postal"))
+        return API._postal_codes[1]
+
+    # Fonction de chargement du cache des classes d'altitude
+    def get_altitude_cache(self):
+        with API._geo_lock:
+            if API._altitude_cache is None:
+                try:
+                    with open(ALTITUDE_CACHE_PATH, encoding="utf-8") as f:
+                        API._altitude_cache = json.load(f)
+                except FileNotFoundError:
+                    API._altitude_cache = {}
+            return API._altitude_cache
+
+    # Fonction d'ajout d'une classe d'altitude au cache
+    def save_altitude_cache(self, code_postal, altitude_class):
+        cache = self.get_altitude_cache()
+        with API._geo_lock:
+            cache[code_postal] = altitude_class
+            os.makedirs(os.path.dirname(ALTITUDE_CACHE_PATH), exist_ok=True)
+            tmp_path = tmp_name(ALTITUDE_CACHE_PATH)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(cache, f, ensure_ascii=False)
+            os.replace(tmp_path, ALTITUDE_CACHE_PATH)
+
+    # Fonction de récupération de la classe d'altitude d'un code postal : table locale, puis cache, puis API en dernier recours
+    @timed("api.get_altitude_class")
+    def get_altitude_class(self, code_postal):
+        code = pd.to_numeric(code_postal, errors="coerce")
+        table = self.get_postal_codes()
+        row = table.loc[int(code)] if pd.notna(code) and int(code) in table.index else None
+        if row is not None and pd.notna(row["Classe altitude"]):
+            return row["Classe altitude"]
+
+        code_postal = str(code_postal)
+        cache = self.get_altitude_cache()
+        if code_postal in cache:
+            return cache[code_postal]
+        if not NETWORK_GEOCODING:
+            return features.DEFAULT_ALTITUDE_CLASS
+
+        # Récupération de l'altitude par les API, à partir des coordonnées de la table locale si elles sont connues
+        try:
+            if row is not None and pd.notna(row["Latitude"]) and pd.notna(row["Longitude"]):
+                latitude, longitude = row["Latitude"], row["Longitude"]
+            else:
+                latitude, longitude = self.get_coordinates(code_postal)
+            altitude = self.get_altitude(latitude, longitude) if latitude and longitude else None
+        except Exception as e:
+            print(f"Erreur lors de la récupération de l'altitude : {str(e)}")
+            return features.DEFAULT_ALTITUDE_CLASS
+
+        altitude_class = features.altitude_class([altitude])[0] if altitude is not None else features.DEFAULT_ALTITUDE_CLASS
+        self.save_altitude_cache(code_postal, altitude_class)
+        return altitude_class
\ No newline at end of file
@@ -0,0 +1,328 @@
+import api
+import features
+from api import API, DATA_SELECT
+from interface import DashInterface
+from model import Model
+
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import numpy as np
+import pandas as pd
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlencode, urlparse
+
+# Tailles des jeux de données synthétiques mesurés par défaut
+DEFAULT_SIZES = [100000]
+
+# Part de nouveaux DPE ajoutés au jeu de données pour la mesure de la mise à jour incrémentale
+INCREMENTAL_RATIO = 0.01
+
+# Nombre de répétitions des mesures des callbacks et des prédictions
+DEFAULT_REPEAT = 5
+
+# Types de graphiques de la page "Graphiques"
+GRAPH_TYPES = ['histogram', 'line', 'scatter', 'box']
+
+# Nombre maximal de résultats accessibles par pages numérotées (limite d'Elasticsearch, comme l'API data-fair)
+MAX_RESULT_WINDOW = 10000
+
+# Fichiers du projet copiés dans le dossier de travail du benchmark
+PROJECT_FILES = ["assets/living_standards_69.csv", "model"]
+
+# Fonction de génération d'un jeu de DPE synthétique au format de l'API de l'Ademe
+def generate_dataset(n_rows, start=0, seed=0, min_date="2021-07-01", max_date="2024-10-31"):
+    rng = np.random.default_rng(seed)
+    index = pd.RangeIndex(start, start + n_rows)
+    codes = rng.integers(69001, 69391, n_rows)
+    dates = pd.to_datetime(rng.integers(pd.Timestamp(min_date).value // 10 ** 9, pd.Timestamp(max_date).value // 10 ** 9 + 1, n_rows), unit="s")
+    latitudes = rng.normal(45.75, 0.12, n_rows).round(6)
+    longitudes = rng.normal(4.85, 0.12, n_rows).round(6)
+
+    data = {
+        "N°DPE": "2169E" + pd.Series(index).astype(str).str.zfill(8),
+        "Période_construction": rng.choice(features.PERIOD_LABELS, n_rows),
+        "Surface_habitable_logement": rng.uniform(10, 200, n_rows).round(1),
+        "Nombre_niveau_logement": rng.integers(1, 4, n_rows),
+        "Type_bâtiment": rng.choice(["maison", "appartement", "immeuble"], n_rows),
+        "Hauteur_sous-plafond": rng.uniform(2.2, 3.2, n_rows).round(2),
+        "Type_énergie_principale_chauffage": rng.choice(["Gaz naturel", "Électricité", "Fioul domestique", "Bois – Bûches"], n_rows),
+        "Type_énergie_principale_ECS": rng.choice(["Gaz naturel", "Électricité"], n_rows),
+        "Conso_5_usages_é_finale": rng.uniform(0, 40000, n_rows).round(1),
+        "Conso_chauffage_é_finale": rng.uniform(0, 30000, n_rows).round(1),
+        "Conso_ECS_é_finale": rng.uniform(0, 5000, n_rows).round(1),
+        "Classe_altitude": rng.choice(features.ALTITUDE_LABELS, n_rows, p=[0.8, 0.15, 0.05]),
+        "Etiquette_DPE": rng.choice(list("ABCDEFG"), n_rows),
+        "Nom__commune_(BAN)": "Commune " + pd.Series(codes).astype(str),
+        "Code_postal_(BAN)": codes,
+        "Date_réception_DPE": pd.Series(dates).dt.strftime("%Y-%m-%d"),
+        "_geopoint": pd.Series(latitudes).astype(str) + "," + pd.Series(longitudes).astype(str)
+    }
+    return pd.DataFrame({field: np.asarray(data[field]) for field in unquote(DATA_SELECT).split(",")})
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Bouchon local de la route "lines" de l'API data-fair : pagination (numérotée dans la limite des 10000 premiers résultats,
+    ou par le lien "next" d'une requête triée), sélection des colonnes, recherche par N°DPE et filtre sur la date de réception
+    """
+
+    # Fonction de réponse à une requête GET
+    def do_GET(self):
+        params = {name: values[0] for name, values in parse_qs(urlparse(self.path).query).items()}
+        df = self.server.dataset
+
+        if params.get("q_fields") == "N°DPE":
+            df = df[df["N°DPE"].isin(params["q"].split(","))]
+        match = re.match(r"Date_réception_DPE:\[(\S+) TO (\S+)\]", params.get("qs", ""))
+        if match:
+            low, high = match.groups()
+            if low != "*":
+                df = df[df["Date_réception_DPE"] >= low]
+            if high != "*":
+                df = df[df["Date_réception_DPE"] <= high]
+
+        size, page = int(params.get("size", 12)), int(params.get("page", 1))
+        if page * size > MAX_RESULT_WINDOW:
+            self.send_error(400, "Result window is too large")
+            return
+
+        total = len(df)
+        next_url = None
+        if "sort" in params:
+            df = df.sort_values(params["sort"])
+            if "after" in params:
+                df = df[df[params["sort"]] > params["after"]]
+            page_rows = df.iloc[:size]
+            if len(df) > size:
+                next_url = f"{self.server.url}?{urlencode({**params, 'after': page_rows[params['sort']].iloc[-1]})}"
+        else:
+            page_rows = df.iloc[(page - 1) * size:page * size]
+        if "select" in params:
+            page_rows = page_rows[params["select"].split(",")]
+
+        response = {"total": total, "results": page_rows.to_dict("records")}
+        if next_url:
+            response["next"] = next_url
+        body = json.dumps(response, default=int).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Désactivation du journal des requêtes
+    def log_message(self, format, *args):
+        pass
+
+class StubServer:
+    """
+    Serveur local servant un jeu de DPE synthétique à la place de l'API de l'Ademe
+    """
+
+    # Constructeur de la classe
+    def __init__(self, dataset):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.httpd.dataset = dataset
+        self.url = self.httpd.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/lines"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    # Fonction d'ajout de nouveaux DPE au jeu servi
+    def extend(self, rows):
+        self.httpd.dataset = pd.concat([self.httpd.dataset, rows], ignore_index=True)
+
+    # Fonction d'arrêt du serveur
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class Benchmark:
+    """
+    Mesure des temps d'exécution des traitements principaux du projet sur des jeux de données synthétiques
+    """
+
+    # Constructeur de la classe
+    def __init__(self, repeat=DEFAULT_REPEAT, skip=()):
+        self.repeat = repeat
+        self.skip = set(skip)
+        self.results = {}
+
+    # Fonction de mesure d'une fonction, répétée plusieurs fois
+    def measure(self, name, func, repeat=1):
+        if name.split("/")[0] in self.skip:
+            return
+        durations = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            durations.append(time.perf_counter() - start)
+        self.results[name] = {
+            "median": statistics.median(durations),
+            "min": min(durations),
+            "max": max(durations),
+            "runs": len(durations)
+        }
+        print(f"  {name} : {self.results[name]['median']:.3f} s")
+
+    # Fonction d'appel d'un callback Dash par la route de mise à jour des composants
+    def callback(self, client, output, inputs, state=()):
+        # Plusieurs sorties sont désignées par une liste et transmises sous la forme "..sortie1...sortie2.."
+        outputs = [{"id": o.split(".")[0], "property": o.split(".")[1]} for o in ([output] if isinstance(output, str) else output)]
+        response = client.post("/_dash-update-component", json={
+            "output": output if isinstance(output, str) else f"..{'...'.join(output)}..",
+            "outputs": outputs[0] if isinstance(output, str) else outputs,
+            "inputs": [{"id": i.split(".")[0], "property": i.split(".")[1], "value": v} for i, v in inputs],
+            "state": [{"id": s.split(".")[0], "property": s.split(".")[1], "value": v} for s, v in state],
+            "changedPropIds": [inputs[0][0]]
+        })
+        if response.status_code not in (200, 204):
+            raise RuntimeError(f"Callback {output} : [{response.status_code}] {response.get_data(as_text=True)[:200]}")
+        return response
+
+    # Fonction de mesure de l'ensemble des traitements pour une taille de données
+    def run(self, n_rows):
+        print(f"Jeu de données de {n_rows} DPE")
+        stub = StubServer(generate_dataset(n_rows))
+        api.API_URL = stub.url
+        api.NETWORK_GEOCODING = False
+
+        try:
+            # Récupération complète puis mise à jour incrémentale des données
+            self.measure("get_data/cold", lambda: API().update_data())
+            stub.extend(generate_dataset(max(int(n_rows * INCREMENTAL_RATIO), 1), start=n_rows, seed=1, min_date="2024-11-01", max_date="2024-11-30"))
+            self.measure("get_data/incremental", lambda: API().update_data())
+        finally:
+            stub.close()
+
+        # Chargement des données de l'interface
+        interfaces = []
+        self.measure("interface/load", lambda: interfaces.append(DashInterface()))
+        interface = interfaces[-1] if interfaces else DashInterface()
+        client = interface.server.test_client()
+
+        # Callbacks des pages "Statistiques", "Graphiques", "Cartographie" et "Tableau"
+        filters = ["statistics-output.children", [
+            ("filter-nom-commune.value", None),
+            ("filter-type-batiment.value", ["maison"]),
+            ("filter-type-energie-chauffage.value", None),
+            ("filter-type-energie-ecs.value", None)
+        ]]
+        self.measure("update_statistics", lambda: self.callback(client, *filters), self.repeat)
+
+        for graph_type in GRAPH_TYPES:
+            self.measure(f"update_dynamic_plot/{graph_type}", lambda: (interface.figure_cache.clear(), self.callback(client, "dynamic-plot.figure", [
+                ("x-axis.value", "Surface habitable logement"),
+                ("y-axis.value", "Consommation totale"),
+                ("selected-graph-type.data", graph_type),
+                ("data-filter.value", list("ABCDEFG"))
+            ])), self.repeat)
+
+        self.measure("generate_map_plotly", lambda: (interface.figure_cache.clear(), self.callback(client, "map-plotly.figure", [
+            ("visuals-subtabs.value", "subtab-4"),
+            ("data-filter.value", list("ABCDEFG")),
+            ("map-plotly.relayoutData", None)
+        ])), self.repeat)
+
+        # Pages du tableau, sans tri puis triées et filtrées
+        table_views = {
+            "update_table": ([], ""),
+            "update_table/sorted": ([{"column_id": "Consommation totale", "direction": "desc"}], ""),
+            "update_table/filtered": ([{"column_id": "Surface habitable logement", "direction": "asc"}], "{Étiquette DPE} icontains D && {Surface habitable logement} > 50")
+        }
+        for name, (sort_by, filter_query) in table_views.items():
+            pages = iter(np.random.default_rng(0).integers(0, max(len(interface.df) // 100, 1), self.repeat))
+            self.measure(name, lambda: self.callback(client, ["data-table.data", "data-table.page_count"], [
+                ("data-table.page_current", int(next(pages))),
+                ("data-table.page_size", 10),
+                ("data-table.sort_by", sort_by),
+                ("data-table.filter_query", filter_query)
+            ], [("data-table.data", None)]), self.repeat)
+
+        # Prédictions unitaires avec les modèles enregistrés
+        dwelling = {
+            'Code postal': [69001],
+            'Période construction': [1990],
+            'Type bâtiment': ['appartement'],
+            'Surface habitable logement': [60],
+            'Nombre niveau logement': [1],
+            'Hauteur sous-plafond': [2.5],
+            'Type énergie chauffage': ['Gaz naturel'],
+            'Type énergie ECS': ['Électricité']
+        }
+        self.measure("predict_DPE", lambda: Model.predict_DPE(pd.DataFrame({
+            **dwelling, 'Consommation totale': [15000], 'Consommation chauffage': [10000], 'Consommation ECS': [2000]
+        })), self.repeat)
+        self.measure("predict_conso", lambda: Model.predict_conso(pd.DataFrame({**dwelling, 'Étiquette DPE': ['D']})), self.repeat)
+
+        # Entraînement complet des modèles
+        self.measure("train_models", lambda: Model.train_models(None, warm_start=False))
+
+        return self.results
+
+# Fonction de comparaison de deux fichiers de résultats
+def compare(previous, current):
+    for size, results in current["results"].items():
+        print(f"Comparaison pour {size} DPE")
+        for name, result in results.items():
+            before = previous["results"].get(size, {}).get(name)
+            if before:
+                print(f"  {name} : {before['median']:.3f} s -> {result['median']:.3f} s (x{result['median'] / before['median']:.2f})")
+
+def main():
+    """
+    Fonction de mesure des temps d'exécution des traitements du projet sur des jeux de données synthétiques
+    """
+
+    parser = argparse.ArgumentParser(description="Benchmark de la récupération des données, de l'interface et des modèles sur des données synthétiques")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="nombres de DPE des jeux de données (par exemple : 100000 1000000 5000000)")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help=f"nombre de répétitions des mesures des callbacks et des prédictions (par défaut : {DEFAULT_REPEAT})")
+    parser.add_argument("--skip", nargs="*", default=[], help="mesures à ignorer (par exemple : train_models get_data)")
+    parser.add_argument("-o", "--output", default="benchmark_results.json", help="fichier JSON des résultats (par défaut : benchmark_results.json)")
+    parser.add_argument("--compare", help="fichier JSON de résultats précédents à comparer")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    project = os.getcwd()
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": {}
+    }
+
+    for n_rows in args.sizes:
+        # Dossier de travail temporaire contenant les fichiers nécessaires, les données du projet restant inchangées
+        workdir = tempfile.mkdtemp(prefix="benchmark_")
+        for path in PROJECT_FILES:
+            target = os.path.join(workdir, path)
+            if os.path.isdir(path):
+                shutil.copytree(path, target)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copy(path, target)
+
+        os.chdir(workdir)
+        try:
+            report["results"][str(n_rows)] = Benchmark(args.repeat, args.skip).run(n_rows)
+        finally:
+            os.chdir(project)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Résultats enregistrés dans {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import os
+import threading
+import numpy as np
+from collections import OrderedDict
+
+# Taille maximale du cache des figures par worker (en Mo)
+FIGURE_CACHE_MB = int(os.environ.get("FIGURE_CACHE_MB", 128))
+
+# Nombre maximal de figures conservées
+FIGURE_CACHE_ENTRIES = 64
+
+# Fonction d'estimation de la mémoire occupée par les données d'une figure Plotly (en octets)
+def figure_size(fig):
+    size = 0
+    for trace in fig.data:
+        for attr in ('x', 'y', 'lat', 'lon', 'z', 'customdata', 'hovertext', 'text', 'ids'):
+            values = getattr(trace, attr, None) if attr in trace else None
+            if values is None or isinstance(values, str):
+                continue
+            values = np.asarray(values)
+            size += values.nbytes if values.dtype != object else values.size * 64
+    return size
+
+class FigureCache:
+    """
+    Cache LRU des figures Plotly, borné en nombre de figures et en mémoire
+    """
+
+    # Constructeur de la classe
+    def __init__(self, max_bytes=FIGURE_CACHE_MB * 1024 ** 2, max_entries=FIGURE_CACHE_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    # Fonction de récupération d'une figure, construite par la fonction "build" si elle n'est pas en cache
+    def get_or_build(self, key, build):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+
+        fig = build()
+        self.put(key, fig)
+        return fig
+
+    # Fonction d'ajout d'une figure au cache, en supprimant les moins récemment utilisées si nécessaire
+    def put(self, key, fig):
+        size = figure_size(fig)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (fig, size)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self.size -= self.entries.popitem(last=False)[1][1]
+
+    # Fonction de vidage du cache
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    # Fonction de récupération des statistiques du cache
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries),
+                'size': self.size
+            }
\ No newline at end of file
@@ -0,0 +1,106 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Nombre maximal de points envoyés au navigateur pour un graphique, au-delà duquel les données sont agrégées
+PLOT_POINT_BUDGET = int(os.environ.get("PLOT_POINT_BUDGET", 20000))
+
+# Nombre maximal de classes d'un histogramme agrégé
+MAX_HISTOGRAM_BINS = 200
+
+# Fonction de découpage d'un axe en classes : intervalles réguliers pour une variable numérique, modalités sinon
+def axis_bins(values, n_bins):
+    if pd.api.types.is_numeric_dtype(values):
+        values = values.astype('float64')
+        low, high = values.min(), values.max()
+        if not np.isfinite(low) or high <= low:
+            return pd.Series(np.zeros(len(values), dtype=np.int64), index=values.index), np.array([low])
+        edges = np.linspace(low, high, n_bins + 1)
+        index = np.clip(np.searchsorted(edges, values, side='right') - 1, 0, n_bins - 1)
+        centers = (edges[:-1] + edges[1:]) / 2
+        return pd.Series(index, index=values.index).where(values.notna()), centers
+    return values, None
+
+# Fonction d'agrégation d'un histogramme : effectif par classe et par modalité de la couleur
+def bin_histogram(df, x_col, color_col):
+    values = df[x_col]
+    if pd.api.types.is_numeric_dtype(values):
+        values = values.astype('float64').dropna()
+        edges = np.histogram_bin_edges(values, bins='auto')
+        if len(edges) > MAX_HISTOGRAM_BINS + 1:
+            edges = np.linspace(edges[0], edges[-1], MAX_HISTOGRAM_BINS + 1)
+        index = np.clip(np.searchsorted(edges, values, side='right') - 1, 0, len(edges) - 2)
+        counts = pd.DataFrame({'bin': index, color_col: df.loc[values.index, color_col]})
+        counts = counts.groupby(['bin', color_col], observed=True).size().reset_index(name='count')
+        counts[x_col] = (edges[counts['bin']] + edges[counts['bin'] + 1]) / 2
+        return counts.drop(columns='bin'), float(edges[1] - edges[0]) if len(edges) > 1 else None
+    counts = df.groupby([x_col, color_col], observed=True).size().reset_index(name='count')
+    return counts, None
+
+# Fonction de rastérisation d'un nuage de points : une grille de cellules par modalité de la couleur, chaque cellule non vide devenant un point
+def rasterize(df, x_col, y_col, color_col, budget=PLOT_POINT_BUDGET):
+    n_colors = max(df[color_col].nunique(), 1)
+    n_bins = max(int(np.sqrt(budget / n_colors)), 1)
+    x_bins, x_centers = axis_bins(df[x_col], n_bins)
+    y_bins, y_centers = axis_bins(df[y_col], n_bins)
+
+    cells = pd.DataFrame({'x': x_bins, 'y': y_bins, color_col: df[color_col]})
+    cells = cells.groupby(['x', 'y', color_col], observed=True).size().reset_index(name='Nombre de DPE')
+
+    # Coordonnées du centre de chaque cellule
+    cells[x_col] = x_centers[cells['x'].astype(np.int64)] if x_centers is not None else cells['x']
+    cells[y_col] = y_centers[cells['y'].astype(np.int64)] if y_centers is not None else cells['y']
+    return cells.drop(columns=['x', 'y'])
+
+# Fonction de sélection des indices à conserver par l'algorithme LTTB (Largest-Triangle-Three-Buckets)
+def lttb(x, y, n_out):
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    bucket_edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(n_out - 2):
+        start, end = bucket_edges[i], max(bucket_edges[i + 1], bucket_edges[i] + 1)
+
+        # Point moyen du seau suivant
+        next_start, next_end = end, bucket_edges[i + 2] if i + 2 < len(bucket_edges) else n
+        next_end = max(next_end, next_start + 1)
+        mean_x, mean_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+
+        # Point du seau courant formant le plus grand triangle avec le point précédent et le point moyen suivant
+        areas = np.abs((x[previous] - mean_x) * (y[start:end] - y[previous]) - (x[previous] - x[start:end]) * (mean_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+    return selected
+
+# Fonction de sous-échantillonnage d'une série par modalité de la couleur, les données étant triées selon l'axe des abscisses
+def downsample_lines(df, x_col, y_col, color_col, budget=PLOT_POINT_BUDGET):
+    groups = [group for _, group in df.groupby(color_col, observed=True)]
+    n_out = max(budget // max(len(groups), 1), 3)
+
+    sampled = []
+    for group in groups:
+        group = group.dropna(subset=[x_col, y_col])
+        x = group[x_col].to_numpy(dtype='float64') if pd.api.types.is_numeric_dtype(group[x_col]) else np.arange(len(group), dtype='float64')
+        y = group[y_col].to_numpy(dtype='float64') if pd.api.types.is_numeric_dtype(group[y_col]) else pd.factorize(group[y_col])[0].astype('float64')
+        sampled.append(group.iloc[lttb(x, y, n_out)])
+    return pd.concat(sampled) if sampled else df.iloc[:0]
+
+# Fonction de calcul des statistiques d'une boîte à moustaches par modalité de la couleur
+def box_statistics(df, y_col, color_col):
+    values = df[[color_col, y_col]].dropna()
+    values[y_col] = values[y_col].astype('float64')
+    grouped = values.groupby(color_col, observed=True)[y_col]
+    stats = grouped.quantile([0.25, 0.5, 0.75]).unstack()
+    stats.columns = ['q1', 'median', 'q3']
+
+    # Moustaches : valeurs extrêmes situées à moins de 1,5 fois l'écart interquartile des quartiles
+    iqr = stats['q3'] - stats['q1']
+    values = values.join((stats['q1'] - 1.5 * iqr).rename('low'), on=color_col).join((stats['q3'] + 1.5 * iqr).rename('high'), on=color_col)
+    inside = values[(values[y_col] >= values['low']) & (values[y_col] <= values['high'])].groupby(color_col, observed=True)[y_col]
+    stats['lowerfence'] = inside.min()
+    stats['upperfence'] = inside.max()
+    return stats
@@ -0,0 +1,86 @@
+import io
+import os
+import zlib
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Nombre de lignes converties et envoyées à chaque étape d'un export
+EXPORT_CHUNK_ROWS = int(os.environ.get("EXPORT_CHUNK_ROWS", 50000))
+
+# Formats d'export : type MIME et extension du fichier
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "csv.gz": ("application/gzip", "csv.gz"),
+    "parquet": ("application/vnd.apache.parquet", "parquet")
+}
+
+# Fonction de découpage des lignes à exporter en blocs de positions
+def iter_row_chunks(n_rows, rows=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    total = n_rows if rows is None else len(rows)
+    for start in range(0, total, chunk_rows):
+        end = min(start + chunk_rows, total)
+        yield np.arange(start, end) if rows is None else rows[start:end]
+
+# Fonction d'export au format CSV (séparateur "|", comme le fichier des données), bloc par bloc
+def iter_csv(df, rows=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    yield "|".join(df.columns).encode("utf-8") + b"\n"
+    for positions in iter_row_chunks(len(df), rows, chunk_rows):
+        yield df.iloc[positions].to_csv(index=False, header=False, sep="|").encode("utf-8")
+
+# Fonction de compression gzip d'un flux d'octets
+def iter_gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+class ChunkSink(io.RawIOBase):
+    """
+    Fichier en écriture seule dont le contenu est récupéré et vidé après chaque groupe de lignes Parquet
+    """
+
+    # Constructeur de la classe
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+
+    # Fonction indiquant que le fichier est accessible en écriture
+    def writable(self):
+        return True
+
+    # Fonction d'écriture d'octets
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        return len(data)
+
+    # Fonction de position dans le fichier, utilisée par l'écrivain Parquet
+    def tell(self):
+        return self.position
+
+    # Fonction de récupération des octets écrits depuis le dernier appel
+    def drain(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+# Fonction d'export au format Parquet, un groupe de lignes par bloc
+def iter_parquet(df, rows=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    schema = pa.Schema.from_pandas(df.iloc[:0], preserve_index=False)
+    sink = ChunkSink()
+    with pq.ParquetWriter(sink, schema, compression="snappy") as writer:
+        for positions in iter_row_chunks(len(df), rows, chunk_rows):
+            writer.write_table(pa.Table.from_pandas(df.iloc[positions], schema=schema, preserve_index=False))
+            yield sink.drain()
+    yield sink.drain()
+
+# Fonction d'export des lignes d'un DataFrame (toutes ou aux positions données, dans leur ordre) dans le format demandé
+def iter_export(df, rows=None, export_format="csv", chunk_rows=EXPORT_CHUNK_ROWS):
+    if export_format == "parquet":
+        return iter_parquet(df, rows, chunk_rows)
+    if export_format == "csv.gz":
+        return iter_gzip(iter_csv(df, rows, chunk_rows))
+    return iter_csv(df, rows, chunk_rows)
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+# Bornes (incluses à gauche) et libellés des périodes de construction
+PERIOD_BINS = [-np.inf, 1948, 1975, 1978, 1983, 1989, 2001, 2006, 2013, 2022, np.inf]
+PERIOD_LABELS = [
+    'avant 1948',
+    '1948-1974',
+    '1975-1977',
+    '1978-1982',
+    '1983-1988',
+    '1989-2000',
+    '2001-2005',
+    '2006-2012',
+    '2013-2021',
+    'après 2021'
+]
+
+# Bornes (incluses à droite) et libellés des classes d'altitude : moins de 400 m, de 400 m à 800 m inclus, plus de 800 m
+# (la première borne est le plus grand nombre inférieur à 400 pour que 400 m soit dans la classe "400-800m")
+ALTITUDE_BINS = [-np.inf, np.nextafter(400, -np.inf), 800, np.inf]
+ALTITUDE_LABELS = ['inférieur à 400m', '400-800m', 'supérieur à 800m']
+
+# Classe d'altitude utilisée lorsque l'altitude est inconnue
+DEFAULT_ALTITUDE_CLASS = ALTITUDE_LABELS[0]
+
+# Variables qualitatives transformées en indicatrices
+DUMMY_COLUMNS = [
+    'Période construction', 
+    'Type bâtiment', 
+    'Classe altitude', 
+    'Type énergie ECS', 
+    'Type énergie chauffage'
+]
+
+# Fonction de transformation des années de construction en périodes de construction
+def construction_period(years):
+    years = pd.to_numeric(pd.Series(years), errors='coerce')
+    return pd.cut(years, bins=PERIOD_BINS, labels=PERIOD_LABELS, right=False).astype(object)
+
+# Fonction de transformation des altitudes (en mètres) en classes d'altitude
+def altitude_class(altitudes):
+    altitudes = pd.to_numeric(pd.Series(altitudes), errors='coerce')
+    classes = pd.cut(altitudes, bins=ALTITUDE_BINS, labels=ALTITUDE_LABELS, right=True).astype(object)
+    return classes.fillna(DEFAULT_ALTITUDE_CLASS)
+
+# Fonction d'ajout de la médiane du niveau de vie de la commune, ou de la moyenne si la commune n'est pas renseignée
+def add_living_standards(df, df_ls):
+    df = df.copy()
+    df['Code postal'] = pd.to_numeric(df['Code postal'], errors='coerce')
+    df = pd.merge(df, df_ls, how='left', on='Code postal')
+    df["Médiane niveau vie"] = df["Médiane niveau vie"].fillna(df_ls["Médiane niveau vie"].mean())
+    return df
+
+# Fonction de transformation des variables qualitatives en indicatrices
+def encode(df, feature_names=None):
+    df = pd.get_dummies(df, columns=[col for col in DUMMY_COLUMNS if col in df.columns])
+    if feature_names is not None:
+        df = df.reindex(columns=feature_names, fill_value=0)
+    return df
+
+# Vérification des classes aux bornes, identiques aux seuils d'origine des périodes et des altitudes
+assert list(construction_period([1947, 1948, 1974, 1975, 2021, 2022])) == ['avant 1948', '1948-1974', '1948-1974', '1975-1977', '2013-2021', 'après 2021']
+assert list(altitude_class([399.9, 400, 800, 800.1])) == ['inférieur à 400m', '400-800m', '400-800m', 'supérieur à 800m']
@@ -0,0 +1,172 @@
+import operator as op
+import re
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+
+# Condition d'un filtre du tableau Dash : colonne, opérateur (précédé de "i" ou "s" selon la casse) et valeur
+FILTER_PATTERN = re.compile(r'^\s*\{(?P<name>[^}]*)\}\s*[is]?(?P<operator>>=|<=|!=|=|<|>|contains|datestartswith|eq|ne|lt|le|gt|ge)\s*(?P<value>.*?)\s*$')
+
+# Opérateurs des filtres écrits en toutes lettres
+OPERATOR_ALIASES = {'eq': '=', 'ne': '!=', 'lt': '<', 'le': '<=', 'gt': '>', 'ge': '>='}
+
+# Comparaisons associées aux opérateurs des filtres
+COMPARISONS = {'=': op.eq, '!=': op.ne, '<': op.lt, '<=': op.le, '>': op.gt, '>=': op.ge}
+
+# Nombre maximal de permutations de tri et de vues (filtre et tri) conservées
+INDEX_CACHE_ENTRIES = 8
+
+# Fonction de découpage d'une requête de filtre du tableau Dash en conditions (colonne, opérateur, valeur)
+def parse_filter(filter_query):
+    conditions = []
+    for part in (filter_query or '').split(' && '):
+        match = FILTER_PATTERN.match(part)
+        if match is None:
+            continue
+        operator, value = match['operator'], match['value']
+        if len(value) > 1 and value[0] == value[-1] and value[0] in ("'", '"', '`'):
+            value = value[1:-1].replace('\\' + value[0], value[0])
+        conditions.append((match['name'], OPERATOR_ALIASES.get(operator, operator), value))
+    return conditions
+
+# Fonction de comparaison d'une série de chaînes à une valeur, sans tenir compte de la casse
+def compare_strings(values, operator, value):
+    values = values.str.lower()
+    value = value.lower()
+    if operator == 'contains':
+        return values.str.contains(value, regex=False)
+    if operator == 'datestartswith':
+        return values.str.startswith(value)
+    return COMPARISONS[operator](values, value)
+
+class LRU(OrderedDict):
+    """
+    Dictionnaire borné supprimant les entrées les moins récemment utilisées
+    """
+
+    # Constructeur de la classe
+    def __init__(self, max_entries=INDEX_CACHE_ENTRIES):
+        super().__init__()
+        self.max_entries = max_entries
+
+    # Fonction de récupération d'une entrée, construite par la fonction "build" si elle est absente
+    def get_or_build(self, key, build):
+        if key in self:
+            self.move_to_end(key)
+            return self[key]
+        value = self[key] = build()
+        if len(self) > self.max_entries:
+            self.popitem(last=False)
+        return value
+
+class TableIndex:
+    """
+    Index des colonnes du tableau, construits à la première utilisation : valeurs triées pour les colonnes numériques,
+    index inversés (lignes de chaque modalité) pour les colonnes catégorielles, et permutations de tri
+    """
+
+    # Constructeur de la classe
+    def __init__(self, df):
+        self.df = df
+        self.n_rows = len(df)
+        self.dtype = np.int32 if self.n_rows < 2 ** 31 else np.int64
+        self.sorted_columns = {}
+        self.inverted = {}
+        self.orders = LRU()
+        self.views = LRU()
+        self.lock = threading.Lock()
+
+    # Fonction de récupération des valeurs triées d'une colonne numérique avec la permutation correspondante (valeurs manquantes à la fin)
+    def sorted_column(self, col):
+        if col not in self.sorted_columns:
+            values = np.asarray(self.df[col], dtype='float64')
+            order = np.argsort(values, kind='stable').astype(self.dtype)
+            self.sorted_columns[col] = (values[order], order, int(np.count_nonzero(~np.isnan(values))))
+        return self.sorted_columns[col]
+
+    # Fonction de récupération de l'index inversé d'une colonne catégorielle : lignes de chaque modalité
+    def inverted_index(self, col):
+        if col not in self.inverted:
+            codes = np.asarray(self.df[col].cat.codes)
+            order = np.argsort(codes, kind='stable').astype(self.dtype)
+            bounds = np.searchsorted(codes[order], np.arange(-1, len(self.df[col].cat.categories) + 1))
+            self.inverted[col] = [order[bounds[i + 1]:bounds[i + 2]] for i in range(len(self.df[col].cat.categories))]
+        return self.inverted[col]
+
+    # Fonction de calcul de la permutation de tri stable d'une colonne, les valeurs manquantes étant placées à la fin
+    def build_order(self, col, ascending):
+        column = self.df[col]
+        if pd.api.types.is_numeric_dtype(column):
+            if ascending:
+                return self.sorted_column(col)[1]
+            return np.argsort(-np.asarray(column, dtype='float64'), kind='stable').astype(self.dtype)
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            # Rang de chaque modalité dans l'ordre alphabétique
+            categories = column.cat.categories.astype(str)
+            rank = np.empty(len(categories) + 1, dtype=np.int64)
+            rank[np.argsort(categories, kind='stable')] = np.arange(len(categories)) if ascending else np.arange(len(categories))[::-1]
+            rank[-1] = len(categories)
+            return np.argsort(rank[np.asarray(column.cat.codes)], kind='stable').astype(self.dtype)
+        return np.asarray(column.reset_index(drop=True).sort_values(ascending=ascending, kind='stable', na_position='last').index, dtype=self.dtype)
+
+    # Fonction de calcul des lignes vérifiant une condition d'un filtre
+    def condition_mask(self, col, operator, value):
+        column = self.df[col]
+        mask = np.zeros(self.n_rows, dtype=bool)
+
+        if pd.api.types.is_numeric_dtype(column) and operator != 'datestartswith':
+            try:
+                # Valeur convertie dans le type de la colonne pour que l'égalité porte sur les valeurs affichées
+                value = float(np.asarray(float(value)).astype(column.dtype)) if pd.api.types.is_float_dtype(column) else float(value)
+            except ValueError:
+                return mask
+            # Recherche dichotomique dans les valeurs triées
+            values, order, valid = self.sorted_column(col)
+            left, right = np.searchsorted(values[:valid], value, side='left'), np.searchsorted(values[:valid], value, side='right')
+            ranges = {
+                '=': (left, right), 'contains': (left, right),
+                '<': (0, left), '<=': (0, right),
+                '>': (right, valid), '>=': (left, valid)
+            }
+            if operator == '!=':
+                mask[order[:valid]] = True
+                mask[order[left:right]] = False
+            else:
+                start, end = ranges[operator]
+                mask[order[start:end]] = True
+        elif isinstance(column.dtype, pd.CategoricalDtype):
+            # Union des lignes des modalités vérifiant la condition
+            matches = compare_strings(pd.Series(column.cat.categories.astype(str)), operator, str(value))
+            postings = self.inverted_index(col)
+            for code in np.flatnonzero(matches.to_numpy()):
+                mask[postings[code]] = True
+        else:
+            mask = compare_strings(column.astype('string'), operator, str(value)).fillna(False).to_numpy(dtype=bool)
+        return mask
+
+    # Fonction de calcul des lignes d'une vue (filtre puis tri), dans l'ordre d'affichage
+    def build_view(self, filter_query, sort_key):
+        conditions = [c for c in parse_filter(filter_query) if c[0] in self.df.columns]
+        mask = None
+        for col, operator, value in conditions:
+            condition = self.condition_mask(col, operator, value)
+            mask = condition if mask is None else mask & condition
+
+        if sort_key is None:
+            return np.flatnonzero(mask).astype(self.dtype) if mask is not None else None
+        order = self.orders.get_or_build(sort_key, lambda: self.build_order(*sort_key))
+        return order[mask[order]] if mask is not None else order
+
+    # Fonction de récupération des positions des lignes d'une vue dans l'ordre d'affichage (None pour toutes les lignes dans leur ordre)
+    def view(self, filter_query, sort_by):
+        sort_key = (sort_by[0]['column_id'], sort_by[0]['direction'] == 'asc') if sort_by else None
+        with self.lock:
+            return self.views.get_or_build((filter_query or '', sort_key), lambda: self.build_view(filter_query, sort_key))
+
+    # Fonction de récupération des positions des lignes d'une page et du nombre total de lignes de la vue
+    def page(self, filter_query, sort_by, start, end):
+        rows = self.view(filter_query, sort_by)
+        if rows is None:
+            return np.arange(start, min(end, self.n_rows)), self.n_rows
+        return rows[start:end], len(rows)
@@ -1,13 +1,27 @@
-from api import API
 from model import Model
+from aggregates import StatisticsCube
+from cache import FigureCache
+from jobs import JobRunner
+from metrics import metrics, profiler
+from indexing import TableIndex
+from export import EXPORT_FORMATS, iter_export
+from renderer import Renderer
+from downsampling import PLOT_POINT_BUDGET, bin_histogram, box_statistics, downsample_lines, rasterize
+from spatial import SpatialIndex, viewport_bounds
+from storage import SHARED_MEMORY, concat_data, get_storage, load_data, memory_report, migrate_storage
 
 import dash
 from dash import html, dcc, dash_table
 from dash.dependencies import Input, Output, State
-import io
+import flask
+import functools
 import os
+import threading
+import time
+import urllib.parse
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
 
 class DashInterface:
     """
@@ -19,10 +33,96 @@ class DashInterface:
         self.app = dash.Dash(__name__, external_stylesheets=['/assets/style.css'])
         self.app.title = "Projet Enedis"
         self.server = self.app.server
-        self.df = pd.read_csv('assets/data_69.csv', sep='|')
+        migrate_storage()
+        self.storage = get_storage()
+        self.figure_cache = FigureCache()
+        self.reload_lock = threading.Lock()
+        self.version_stamp = self.read_version_stamp()
+        self.stored_version = self.storage.version()
+        self.set_data(load_data(self.storage))
+        self.print_memory_usage()
+        self.jobs = JobRunner()
+        self.renderer = Renderer()
         self.current_fig = None
         self.setup_layout()
+        self.instrument_callbacks()
         self.setup_callbacks()
+        self.setup_metrics()
+
+        # Vérification de la version des données avant chaque requête
+        self.server.before_request(self.reload_data_if_needed)
+
+    # Données chargées et structures qui en dépendent, remplacées ensemble en une seule affectation lors d'un rechargement
+    @property
+    def data_version(self):
+        return self.dataset[0]
+
+    @property
+    def df(self):
+        return self.dataset[1]
+
+    @property
+    def stats_cube(self):
+        return self.dataset[2]
+
+    @property
+    def spatial_index(self):
+        return self.dataset[3]
+
+    @property
+    def table_index(self):
+        return self.dataset[4]
+
+    # Fonction de remplacement des données et de reconstruction des agrégats et des index
+    def set_data(self, df):
+        self.dataset = (
+            self.storage.signature(),
+            df,
+            StatisticsCube(df),
+            SpatialIndex(df['Latitude'], df['Longitude'], df['Étiquette DPE']),
+            TableIndex(df)
+        )
+        # Les figures construites à partir des anciennes données ne sont plus utilisables
+        self.figure_cache.clear()
+
+    # Fonction de lecture de l'empreinte du fichier de version des données (un seul appel système)
+    def read_version_stamp(self):
+        try:
+            stat = os.stat(self.storage.version_path)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    # Fonction de rechargement des données si une nouvelle version a été enregistrée, vérifiée à chaque requête
+    def reload_data_if_needed(self):
+        stamp = self.read_version_stamp()
+        if stamp == self.version_stamp:
+            return
+        with self.reload_lock:
+            if stamp == self.version_stamp:
+                return
+            version = self.storage.version()
+            previous = self.stored_version
+
+            # Seules les lignes ajoutées sont chargées si les données n'ont pas été réécrites entièrement
+            if not SHARED_MEMORY and previous is not None and version is not None and version["base"] == previous["base"]:
+                delta = self.storage.load_delta(len(self.df), compact=True)
+                self.set_data(concat_data(self.df, delta))
+                print(f"Données rechargées : {len(delta)} nouvelles lignes")
+            else:
+                # Les colonnes partagées sont construites par l'ingestion : le worker ne fait que les relire
+                self.set_data(load_data(self.storage, build=False))
+                print(f"Données rechargées : {len(self.df)} lignes")
+
+            self.stored_version = version
+            self.version_stamp = stamp
+
+    # Fonction d'affichage de la mémoire occupée par les données
+    def print_memory_usage(self):
+        report = memory_report(self.df)
+        print(f"Mémoire occupée par les données : {report.sum():.2f} Mo ({len(self.df)} lignes)")
+        for col, size in report.items():
+            print(f"  - {col} ({self.df[col].dtype}) : {size:.2f} Mo")
 
     # Fonction d'affichage de l'interface
     def setup_layout(self):
@@ -89,6 +189,7 @@ class DashInterface:
                         html.P("Permet de charger de nouvelles données de logements, en utilisant l'API de l'Ademe."),
                         html.P("Attention : ce bouton ne marche qu'en version locale", style={'font-style':'italic', 'color':'red'}),
                         html.Button("Actualiser les données", id="btn-refresh-data", n_clicks=0, className='ui_button'),
+                        html.Button("Annuler", id="btn-cancel-data", n_clicks=0, className='ui_button'),
                         html.P(id='refresh-api-status', style={'margin-top': '10px', 'color': 'green'})
                     ]
                 ),
@@ -99,9 +200,22 @@ class DashInterface:
                         html.P("Permet de réentraîner les modèle de prédiction du DPE et de la consommation avec les nouvelles données."),
                         html.P("Attention : ce bouton ne marche qu'en version locale et peut prendre un certain moment.", style={'font-style':'italic', 'color':'red'}),
                         html.Button("Réentraîner les modèles de prédiction", id="btn-refresh-models", n_clicks=0, className='ui_button'),
+                        html.Button("Annuler", id="btn-cancel-models", n_clicks=0, className='ui_button'),
                         html.P(id='refresh-models-status', style={'margin-top': '10px', 'color': 'green'})
                     ]
-                )
+                ),
+                html.Div(
+                    className='model_subcontainer',
+                    children=[
+                        html.H2('Mise à jour des modèles de prédiction'),
+                        html.P("Permet de mettre à jour les modèles avec les DPE ajoutés depuis leur dernier entraînement, sans les réentraîner entièrement. Les modèles mis à jour ne sont conservés que s'ils ne sont pas moins performants."),
+                        html.Button("Mettre à jour les modèles", id="btn-update-models", n_clicks=0, className='ui_button'),
+                        html.Button("Annuler", id="btn-cancel-update-models", n_clicks=0, className='ui_button'),
+                        html.P(id='update-models-status', style={'margin-top': '10px', 'color': 'green'})
+                    ]
+                ),
+                # Rafraîchissement de l'état des tâches de fond
+                dcc.Interval(id='jobs-interval', interval=2000)
             ]
         )
 
@@ -134,11 +248,20 @@ class DashInterface:
                 html.H2('Tableau dynamique'),
                 dash_table.DataTable(
                     id='data-table',
-                    columns=[{'name': col, 'id': col} for col in self.df.columns],
+                    columns=[
+                        {'name': col, 'id': col, 'type': 'numeric' if pd.api.types.is_numeric_dtype(self.df[col]) else 'text'}
+                        for col in self.df.columns
+                    ],
                     data=[],
                     page_current=0,
                     page_size=100,
                     page_action='custom',
+                    sort_action='custom',
+                    sort_mode='single',
+                    sort_by=[],
+                    filter_action='custom',
+                    filter_query='',
+                    filter_options={'case': 'insensitive'},
                     virtualization=True,
                     fixed_rows={'headers': True},
                     style_as_list_view=True,
@@ -149,8 +272,21 @@ class DashInterface:
                     }
                 ),
 
-                html.Button("Télécharger les données", id="btn-download-data", n_clicks=0, className='ui_button'),
-                dcc.Download(id="download-data")
+                dcc.RadioItems(
+                    id='export-format',
+                    options=[
+                        {'label': 'CSV', 'value': 'csv'},
+                        {'label': 'CSV compressé (gzip)', 'value': 'csv.gz'},
+                        {'label': 'Parquet', 'value': 'parquet'}
+                    ],
+                    value='csv',
+                    inline=True
+                ),
+                html.A(
+                    html.Button("Télécharger les données filtrées", n_clicks=0, className='ui_button'),
+                    id='export-link',
+                    href='/export?format=csv'
+                )
             ]
         )
     
@@ -311,7 +447,7 @@ class DashInterface:
                                 html.Label("Abscisse", className='dropdown-label'),
                                 dcc.Dropdown(
                                     id='x-axis',
-                                    options=[{'label': col, 'value': col} for col in self.df.columns if col not in ['Étiquette DPE']],
+                                    options=[{'label': col, 'value': col} for col in self.df.columns if col not in ['N°DPE', 'Étiquette DPE']],
                                     value="Période construction"
                                 ),
                             ]
@@ -322,7 +458,7 @@ class DashInterface:
                                 html.Label("Ordonnée", className='dropdown-label'),
                                 dcc.Dropdown(
                                     id='y-axis',
-                                    options=[{'label': col, 'value': col} for col in self.df.columns if col not in ['Étiquette DPE']],
+                                    options=[{'label': col, 'value': col} for col in self.df.columns if col not in ['N°DPE', 'Étiquette DPE']],
                                     value="Surface habitable logement"
                                 ),
                             ]
@@ -376,7 +512,53 @@ class DashInterface:
                 html.H2('Graphique dynamique'),
                 dcc.Graph(id='dynamic-plot'),
 
+                html.Div(
+                    className='subcontainer',
+                    children=[
+                        html.Div(
+                            className='option_box dropdown_item',
+                            children=[
+                                html.Label("Format", className='dropdown-label'),
+                                dcc.Dropdown(
+                                    id='graph-format',
+                                    options=[
+                                        {'label': 'PNG', 'value': 'png'},
+                                        {'label': 'SVG', 'value': 'svg'},
+                                        {'label': 'PDF', 'value': 'pdf'},
+                                        {'label': 'WebP', 'value': 'webp'}
+                                    ],
+                                    value='png',
+                                    clearable=False
+                                ),
+                            ]
+                        ),
+                        html.Div(
+                            className='option_box dropdown_item',
+                            children=[
+                                html.Label("Dimensions (pixels)", className='dropdown-label'),
+                                dcc.Input(id='graph-width', type='number', min=100, max=4000, placeholder='Largeur'),
+                                dcc.Input(id='graph-height', type='number', min=100, max=4000, placeholder='Hauteur'),
+                            ]
+                        ),
+                        html.Div(
+                            className='option_box dropdown_item',
+                            children=[
+                                html.Label("Échelle", className='dropdown-label'),
+                                dcc.Dropdown(
+                                    id='graph-scale',
+                                    options=[{'label': f'x{scale}', 'value': scale} for scale in (1, 2, 3, 4)],
+                                    value=1,
+                                    clearable=False
+                                ),
+                            ]
+                        ),
+                    ]
+                ),
                 html.Button("Télécharger le graphique", id="btn-download-graph", n_clicks=0, className='ui_button'),
+                html.P(id='download-graph-status'),
+                dcc.Store(id='graph-render'),
+                # Vérification de l'avancement du rendu de l'image
+                dcc.Interval(id='graph-render-interval', interval=500, disabled=True),
                 dcc.Download(id="download-graph")
             ]
         )
@@ -387,7 +569,7 @@ class DashInterface:
             className='visuals_container',
             children=[
                 html.H2('Carte dynamique de la répartition des étiquettes DPE'),
-                html.P('Pour des raisons de performances au maximum 100 000 points sont affichés', style={'font-style':'italic', 'text-align':'center'}),
+                html.P('Les DPE sont regroupés par zone lorsque la carte est dézoomée, zoomez pour afficher chaque logement', style={'font-style':'italic', 'text-align':'center'}),
                 html.Div([
                     dcc.Checklist(
                         id='data-filter',
@@ -710,6 +892,231 @@ class DashInterface:
             ]
         )
 
+    # Fonction de construction du graphique dynamique
+    def build_dynamic_plot(self, x_col, y_col, graph_type, filter_values):
+        filtered_df = self.df
+        metrics.add_rows_scanned(len(filtered_df))
+
+        if filter_values:  
+            filtered_df = filtered_df[filtered_df['Étiquette DPE'].isin(filter_values)]
+
+        # Au-delà du nombre maximal de points, les données sont agrégées côté serveur
+        aggregated = len(filtered_df) > PLOT_POINT_BUDGET
+        suffix = " (données agrégées)" if aggregated else ""
+
+        if not aggregated or graph_type == 'line':
+            filtered_df = filtered_df.sort_values(by=x_col, ascending=True)
+        
+        color_map = {
+            'A': '#479E72',
+            'B': '#6BAE5E',
+            'C': '#ADCA7D',
+            'D': '#F3E84F',
+            'E': '#E7B741',
+            'F': '#DE8647',
+            'G': '#C6362C'
+        }
+        category_order = {
+            'Étiquette DPE': ['A', 'B', 'C', 'D', 'E', 'F', 'G']
+        }
+        if graph_type == 'scatter':
+            if aggregated:
+                cells = rasterize(filtered_df, x_col, y_col, 'Étiquette DPE').sort_values(by=x_col)
+                fig = px.scatter(cells, x=x_col, y=y_col, color='Étiquette DPE', hover_data=['Nombre de DPE'],
+                                title=f"Nuage de points ({x_col} vs {y_col}) par Étiquette DPE{suffix}",
+                                color_discrete_map=color_map, category_orders=category_order)
+            else:
+                fig = px.scatter(filtered_df, x=x_col, y=y_col, color='Étiquette DPE',
+                                title=f"Nuage de points ({x_col} vs {y_col}) par Étiquette DPE",
+                                color_discrete_map=color_map, category_orders=category_order)
+        elif graph_type == 'histogram':
+            if aggregated:
+                counts, bin_width = bin_histogram(filtered_df, x_col, 'Étiquette DPE')
+                fig = px.bar(counts.sort_values(by=x_col), x=x_col, y='count', color='Étiquette DPE',
+                            title=f"Histogramme de {x_col} par Étiquette DPE{suffix}",
+                            color_discrete_map=color_map, category_orders=category_order)
+                fig.update_layout(bargap=0)
+                if bin_width:
+                    fig.update_traces(width=bin_width)
+            else:
+                fig = px.histogram(filtered_df, x=x_col, color='Étiquette DPE',
+                                title=f"Histogramme de {x_col} par Étiquette DPE",
+                                color_discrete_map=color_map, category_orders=category_order)
+        elif graph_type == 'box':
+            if aggregated and pd.api.types.is_numeric_dtype(filtered_df[y_col]):
+                stats = box_statistics(filtered_df, y_col, 'Étiquette DPE')
+                fig = go.Figure([
+                    go.Box(
+                        x=[label], name=label, marker_color=color_map.get(label),
+                        q1=[row['q1']], median=[row['median']], q3=[row['q3']],
+                        lowerfence=[row['lowerfence']], upperfence=[row['upperfence']]
+                    )
+                    for label in category_order['Étiquette DPE'] if label in stats.index
+                    for row in [stats.loc[label]]
+                ])
+                fig.update_layout(title=f"Boîte à moustaches de {y_col} par Étiquette DPE{suffix}",
+                                xaxis_title='Étiquette DPE', yaxis_title=y_col, legend_title_text='Étiquette DPE')
+            else:
+                fig = px.box(filtered_df, x='Étiquette DPE', y=y_col,
+                            title=f"Boîte à moustaches de {y_col} par Étiquette DPE",
+                            color_discrete_map=color_map, category_orders=category_order)
+        elif graph_type == 'line':
+            if aggregated:
+                filtered_df = downsample_lines(filtered_df, x_col, y_col, 'Étiquette DPE')
+            fig = px.line(filtered_df, x=x_col, y=y_col, color='Étiquette DPE',
+                        title=f"Graphique en ligne ({x_col} vs {y_col}) par Étiquette DPE{suffix}",
+                        color_discrete_map=color_map, category_orders=category_order)
+
+        return fig
+
+    # Fonction de récupération de la vue de la carte (centre, zoom et emprise) à partir des événements de la carte
+    def map_view(self, relayout_data):
+        relayout_data = relayout_data or {}
+        center = relayout_data.get('mapbox.center') or {}
+        center_lat = center.get('lat', self.spatial_index.center[0])
+        center_lon = center.get('lon', self.spatial_index.center[1])
+        zoom = relayout_data.get('mapbox.zoom', 10)
+
+        # Emprise transmise par la carte, ou estimée à partir du centre et du zoom
+        corners = (relayout_data.get('mapbox._derived') or {}).get('coordinates')
+        if corners:
+            lons, lats = [c[0] for c in corners], [c[1] for c in corners]
+            bounds = (min(lons), min(lats), max(lons), max(lats))
+        else:
+            bounds = viewport_bounds(center_lat, center_lon, zoom)
+        return center_lat, center_lon, zoom, bounds
+
+    # Fonction de construction de la carte : regroupements par zone lorsque la carte est dézoomée, logements de l'emprise sinon
+    def build_map(self, selected_dpe, relayout_data=None):
+        center_lat, center_lon, zoom, bounds = self.map_view(relayout_data)
+        kind, data = self.spatial_index.query(bounds, zoom, selected_dpe)
+        metrics.add_rows_scanned(len(data))
+
+        if kind == 'points':
+            data = self.df.iloc[data][['Nom commune', 'Code postal', 'Étiquette DPE', 'Latitude', 'Longitude']]
+            options = dict(
+                hover_name='Nom commune',
+                hover_data={
+                    'Code postal': True,
+                    'Étiquette DPE': True,
+                    'Latitude': False,
+                    'Longitude': False
+                }
+            )
+        else:
+            options = dict(
+                size='Nombre de DPE',
+                size_max=30,
+                hover_data={
+                    'Nombre de DPE': True,
+                    'Étiquette DPE': True,
+                    'Latitude': False,
+                    'Longitude': False
+                }
+            )
+
+        fig = px.scatter_mapbox(
+            data,
+            lat='Latitude',
+            lon='Longitude',
+            color='Étiquette DPE',
+            color_discrete_map={
+                'A': '#479E72',
+                'B': '#6BAE5E',
+                'C': '#ADCA7D',
+                'D': '#F3E84F',
+                'E': '#E7B741',
+                'F': '#DE8647',
+                'G': '#C6362C'
+            },
+            category_orders={
+                'Étiquette DPE': ['A', 'B', 'C', 'D', 'E', 'F', 'G']
+            },
+            center={'lat': center_lat, 'lon': center_lon},
+            zoom=zoom,
+            height=600,
+            **options
+        )
+
+        # La vue choisie par l'utilisateur est conservée lors de la mise à jour de la carte
+        fig.update_layout(
+            mapbox_style="carto-positron",
+            margin={"r":0,"t":50,"l":0,"b":0},
+            uirevision='map'
+        )
+        return fig
+
+    # Fonction de lancement ou d'annulation d'une tâche de fond selon le bouton cliqué, renvoyant l'état de sa dernière tâche
+    def handle_job(self, kind, start_button, cancel_button):
+        triggered = dash.callback_context.triggered_id
+        if triggered == start_button and self.jobs.submit(kind) is None:
+            return f"Une tâche est déjà en cours. {self.jobs.describe(kind)}"
+        if triggered == cancel_button:
+            self.jobs.cancel(kind)
+        return self.jobs.describe(kind)
+
+    # Fonction de mesure de chaque callback enregistré (durée, lignes parcourues, variation de mémoire et erreurs)
+    def instrument_callbacks(self):
+        register = self.app.callback
+
+        def callback(*args, **kwargs):
+            decorator = register(*args, **kwargs)
+
+            def wrap(func):
+                @functools.wraps(func)
+                def instrumented(*func_args, **func_kwargs):
+                    flask.g.callback_name = f"callback.{func.__name__}"
+                    return metrics.call(flask.g.callback_name, func, *func_args, **func_kwargs)
+                return decorator(instrumented)
+            return wrap
+
+        self.app.callback = callback
+
+    # Fonction d'exposition des métriques au format Prometheus et des piles d'appels du profileur
+    def setup_metrics(self):
+        metrics.register_collector('figure_cache', self.figure_cache.stats)
+        metrics.register_collector('data', lambda: {'rows': len(self.df)})
+
+        # Taille des réponses des callbacks
+        @self.server.after_request
+        def record_payload_size(response):
+            name = flask.g.get('callback_name')
+            if name and not response.direct_passthrough:
+                metrics.payload.observe(name, len(response.get_data()))
+            return response
+
+        @self.server.route('/export')
+        def export_endpoint():
+            return self.export_data(flask.request.args)
+
+        @self.server.route('/metrics')
+        def metrics_endpoint():
+            # Les durées des tâches de fond sont mesurées dans leurs processus et transmises par la table des tâches
+            return flask.Response(metrics.export(others=[("jobs", self.jobs.table.metrics())]), mimetype='text/plain; version=0.0.4')
+
+        @self.server.route('/metrics/profile')
+        def profile_endpoint():
+            return flask.Response(profiler.export(), mimetype='text/plain')
+
+    # Fonction d'export en flux des lignes filtrées et triées du tableau, par blocs, pour que la mémoire du worker reste stable
+    def export_data(self, args):
+        export_format = args.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return flask.Response(f"Format d'export inconnu : {export_format}", status=400, mimetype='text/plain')
+        sort_by = [{'column_id': args['sort'], 'direction': args.get('direction', 'asc')}] if args.get('sort') in self.df.columns else []
+
+        # Données et index lus une seule fois pour qu'un rechargement pendant l'export ne mélange pas deux versions
+        _, df, _, _, table_index = self.dataset
+        rows = table_index.view(args.get('filter', ''), sort_by)
+        metrics.rows.observe('route.export', len(df) if rows is None else len(rows))
+
+        mimetype, extension = EXPORT_FORMATS[export_format]
+        return flask.Response(
+            flask.stream_with_context(iter_export(df, rows, export_format)),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename="data_69.{extension}"'}
+        )
+
     # Fonction pour les callbacks de l'interface
     def setup_callbacks(self):
 
@@ -728,31 +1135,41 @@ class DashInterface:
             elif tab == 'tab-4':
                 return self.render_prediction_page()
             
-        # Callback pour actualiser les données de l'API
+        # Callback pour actualiser les données de l'API dans une tâche de fond et afficher son état
         @self.app.callback(
             Output('refresh-api-status', 'children'),
-            Input('btn-refresh-data', 'n_clicks'),
-            prevent_initial_call=True
+            [
+                Input('btn-refresh-data', 'n_clicks'),
+                Input('btn-cancel-data', 'n_clicks'),
+                Input('jobs-interval', 'n_intervals')
+            ]
         )
-        def refresh_data(n_clicks):
-            if n_clicks:
-                api = API()
-                api.get_data()
-                return "Données actualisées"
-            return ""
+        def refresh_data(n_clicks, cancel_clicks, n_intervals):
+            return self.handle_job('data', 'btn-refresh-data', 'btn-cancel-data')
         
-        # Callback pour réentraîner les modèles de prédiction
+        # Callback pour réentraîner les modèles de prédiction dans une tâche de fond et afficher son état
         @self.app.callback(
             Output('refresh-models-status', 'children'),
-            Input('btn-refresh-models', 'n_clicks'),
-            prevent_initial_call=True
+            [
+                Input('btn-refresh-models', 'n_clicks'),
+                Input('btn-cancel-models', 'n_clicks'),
+                Input('jobs-interval', 'n_intervals')
+            ]
+        )
+        def refresh_models(n_clicks, cancel_clicks, n_intervals):
+            return self.handle_job('models', 'btn-refresh-models', 'btn-cancel-models')
+
+        # Callback pour mettre à jour les modèles de prédiction avec les nouveaux DPE dans une tâche de fond et afficher son état
+        @self.app.callback(
+            Output('update-models-status', 'children'),
+            [
+                Input('btn-update-models', 'n_clicks'),
+                Input('btn-cancel-update-models', 'n_clicks'),
+                Input('jobs-interval', 'n_intervals')
+            ]
         )
-        def refresh_models(n_clicks):
-            if n_clicks:
-                model = Model()
-                model.train_models()
-                return "Modèles réentraînés"
-            return ""
+        def update_models(n_clicks, cancel_clicks, n_intervals):
+            return self.handle_job('update_models', 'btn-update-models', 'btn-cancel-update-models')
         
         # Callback pour afficher le contenu de l'onglet sélectionné dans la page "Visualisations"
         @self.app.callback(
@@ -772,26 +1189,40 @@ class DashInterface:
         # Callback pour afficher uniquement la page demandée dans le tableau
         @self.app.callback(
             Output('data-table', 'data'),
+            Output('data-table', 'page_count'),
             Input('data-table', 'page_current'),
             Input('data-table', 'page_size'),
+            Input('data-table', 'sort_by'),
+            Input('data-table', 'filter_query'),
             State('data-table', 'data')
         )
-        def update_table(page_current, page_size, existing_data):
+        def update_table(page_current, page_size, sort_by, filter_query, existing_data):
             start = page_current * page_size
             end = start + page_size
-            page_data = self.df.iloc[start:end].to_dict('records')
+            # Lignes de la page lues dans les index du tri et du filtre, les données et l'index étant lus une seule fois
+            # pour qu'un rechargement entre les deux lectures n'applique pas les positions d'un index aux nouvelles données
+            _, df, _, _, table_index = self.dataset
+            rows, total = table_index.page(filter_query, sort_by, start, end)
+            page_data = df.iloc[rows].to_dict('records')
+            metrics.add_rows_scanned(len(page_data))
 
-            return page_data
+            return page_data, max(-(-total // page_size), 1)
         
-        # Callback pour télécharger les données en CSV
+        # Callback pour mettre à jour le lien d'export avec le format, le filtre et le tri du tableau
         @self.app.callback(
-            Output("download-data", "data"),
-            Input("btn-download-data", "n_clicks"),
-            prevent_initial_call=True,
+            Output('export-link', 'href'),
+            Input('export-format', 'value'),
+            Input('data-table', 'filter_query'),
+            Input('data-table', 'sort_by')
         )
-        def download_csv(n_clicks):
-            if n_clicks:
-                return dcc.send_file('assets/data_69.csv')
+        def update_export_link(export_format, filter_query, sort_by):
+            params = {'format': export_format or 'csv'}
+            if filter_query:
+                params['filter'] = filter_query
+            if sort_by:
+                params['sort'] = sort_by[0]['column_id']
+                params['direction'] = sort_by[0]['direction']
+            return '/export?' + urllib.parse.urlencode(params)
         
         # Dictionnaire des libellés des indicateurs
         COLUMN_LABELS = {
@@ -810,27 +1241,13 @@ class DashInterface:
                 Input('filter-type-energie-ecs', 'value')
             ]
         )
-        def update_statistics(filter_commune, filter_batiment, filter_energie_ecs, filter_energie_chauffage):
-            filtered_df = self.df
-
-            if filter_commune:
-                filtered_df = filtered_df[filtered_df['Nom commune'].isin(filter_commune)]
-            if filter_batiment:
-                filtered_df = filtered_df[filtered_df['Type bâtiment'].isin(filter_batiment)]
-            if filter_energie_chauffage:
-                filtered_df = filtered_df[filtered_df['Type énergie chauffage'].isin(filter_energie_chauffage)]
-            if filter_energie_ecs:
-                filtered_df = filtered_df[filtered_df['Type énergie ECS'].isin(filter_energie_ecs)]
-
-            stats = {}
-            for col in COLUMN_LABELS.keys():
-                stats[col] = {
-                    'moyenne': filtered_df[col].mean(),
-                    'écart-type': filtered_df[col].std(),
-                    'somme': filtered_df[col].sum(),
-                    'min': filtered_df[col].min(),
-                    'max': filtered_df[col].max(),
-                }
+        def update_statistics(filter_commune, filter_batiment, filter_energie_chauffage, filter_energie_ecs):
+            stats = self.stats_cube.query({
+                'Nom commune': filter_commune,
+                'Type bâtiment': filter_batiment,
+                'Type énergie chauffage': filter_energie_chauffage,
+                'Type énergie ECS': filter_energie_ecs
+            })
 
             stats_output = []
             for col, col_stats in stats.items():
@@ -886,112 +1303,62 @@ class DashInterface:
         )
         def update_dynamic_plot(x_col, y_col, graph_type, filter_values):
             if x_col and y_col:
-                filtered_df = self.df
-
-                if filter_values:  
-                    filtered_df = filtered_df[filtered_df['Étiquette DPE'].isin(filter_values)]
-
-                filtered_df = filtered_df.sort_values(by=x_col, ascending=True)
-                
-                color_map = {
-                    'A': '#479E72',
-                    'B': '#6BAE5E',
-                    'C': '#ADCA7D',
-                    'D': '#F3E84F',
-                    'E': '#E7B741',
-                    'F': '#DE8647',
-                    'G': '#C6362C'
-                }
-                category_order = {
-                    'Étiquette DPE': ['A', 'B', 'C', 'D', 'E', 'F', 'G']
-                }
-                if graph_type == 'scatter':
-                    fig = px.scatter(filtered_df, x=x_col, y=y_col, color='Étiquette DPE',
-                                    title=f"Nuage de points ({x_col} vs {y_col}) par Étiquette DPE",
-                                    color_discrete_map=color_map, category_orders=category_order)
-                elif graph_type == 'histogram':
-                    fig = px.histogram(filtered_df, x=x_col, color='Étiquette DPE',
-                                    title=f"Histogramme de {x_col} par Étiquette DPE",
-                                    color_discrete_map=color_map, category_orders=category_order)
-                elif graph_type == 'box':
-                    fig = px.box(filtered_df, x='Étiquette DPE', y=y_col,
-                                title=f"Boîte à moustaches de {y_col} par Étiquette DPE",
-                                color_discrete_map=color_map, category_orders=category_order)
-                elif graph_type == 'line':
-                    fig = px.line(filtered_df, x=x_col, y=y_col, color='Étiquette DPE',
-                                title=f"Graphique en ligne ({x_col} vs {y_col}) par Étiquette DPE",
-                                color_discrete_map=color_map, category_orders=category_order)
-
+                key = ('graph', graph_type, x_col, y_col, tuple(sorted(filter_values or [])), self.data_version)
+                fig = self.figure_cache.get_or_build(key, lambda: self.build_dynamic_plot(x_col, y_col, graph_type, filter_values))
                 self.current_fig = fig
                 return fig
             return {}
         
-        # Callback pour télécharger le graphique en PNG
+        # Callback pour télécharger le graphique : le rendu est lancé dans le pool de rendu puis son avancement est vérifié
         @self.app.callback(
             Output("download-graph", "data"),
+            Output("graph-render", "data"),
+            Output("graph-render-interval", "disabled"),
+            Output("download-graph-status", "children"),
             Input("btn-download-graph", "n_clicks"),
+            Input("graph-render-interval", "n_intervals"),
+            State("graph-format", "value"),
+            State("graph-width", "value"),
+            State("graph-height", "value"),
+            State("graph-scale", "value"),
+            State("graph-render", "data"),
             prevent_initial_call=True,
         )
-        def download_graph_as_png(n_clicks):
-            if n_clicks:
-                if self.current_fig:
-                    buffer = io.BytesIO()
-                    self.current_fig.write_image(buffer, format="png")
-                    buffer.seek(0)
-                    return dcc.send_bytes(buffer.read(), "graphique.png")
+        def download_graph(n_clicks, n_intervals, image_format, width, height, scale, render):
+            if dash.callback_context.triggered_id == "btn-download-graph":
+                if not self.current_fig:
+                    return dash.no_update, None, True, ""
+                image_format, width, height, scale = self.renderer.options(image_format, width, height, scale)
+                key = self.renderer.submit(self.current_fig, image_format, width, height, scale)
+                return dash.no_update, {'key': key, 'format': image_format, 'submitted': time.time()}, False, "Génération de l'image en cours..."
+
+            if not render:
+                return dash.no_update, None, True, ""
+            status, result = self.renderer.result(render['key'], render['format'], render['submitted'])
+            if status == "pending":
+                return dash.no_update, render, False, dash.no_update
+            if status == "failed":
+                return dash.no_update, None, True, f"Erreur lors de la génération de l'image : {result}"
+            return dcc.send_file(result, filename=f"graphique.{render['format']}"), None, True, ""
 
         # Callback pour mettre à jour la carte 
         @self.app.callback(
             Output('map-plotly', 'figure'),
             [
                 Input('visuals-subtabs', 'value'),
-                Input('data-filter', 'value')
+                Input('data-filter', 'value'),
+                Input('map-plotly', 'relayoutData')
             ]
         )
-        def generate_map_plotly(subtabs_value, selected_dpe):
+        def generate_map_plotly(subtabs_value, selected_dpe, relayout_data):
             if subtabs_value != 'subtab-4':
                 return dash.no_update
 
-            data = self.df.copy()
-
-            if len(data) > 100000:
-                data = data.sample(100000, random_state=None)
-
-            if selected_dpe:
-                data = data[data['Étiquette DPE'].isin(selected_dpe)]
-
-            fig = px.scatter_mapbox(
-                data,
-                lat='Latitude',
-                lon='Longitude',
-                hover_name='Nom commune',
-                hover_data={
-                    'Code postal': True,
-                    'Étiquette DPE': True,
-                    'Latitude': False,
-                    'Longitude': False
-                },
-                color='Étiquette DPE',
-                color_discrete_map={
-                    'A': '#479E72',
-                    'B': '#6BAE5E',
-                    'C': '#ADCA7D',
-                    'D': '#F3E84F',
-                    'E': '#E7B741',
-                    'F': '#DE8647',
-                    'G': '#C6362C'
-                },
-                category_orders={
-                    'Étiquette DPE': ['A', 'B', 'C', 'D', 'E', 'F', 'G']
-                },
-                zoom=10,
-                height=600,
-            )
-
-            fig.update_layout(
-                mapbox_style="carto-positron",
-                margin={"r":0,"t":50,"l":0,"b":0}
-            )
+            # La clé contient la vue arrondie pour que de légers déplacements réutilisent la même carte
+            center_lat, center_lon, zoom, bounds = self.map_view(relayout_data)
+            view = (round(zoom, 1), *(round(b, 3) for b in bounds))
+            key = ('map', tuple(sorted(selected_dpe or [])), view, self.data_version)
+            fig = self.figure_cache.get_or_build(key, lambda: self.build_map(selected_dpe, relayout_data))
             self.current_fig = fig
             return fig
         
@@ -1037,7 +1404,7 @@ class DashInterface:
                     'Type énergie chauffage': [type_energie_chauffage],
                     'Type énergie ECS': [type_energie_ecs],
                     'Consommation totale': [conso_totale],
-                    'Conso_chauffage': [conso_chauffage],
+                    'Consommation chauffage': [conso_chauffage],
                     'Consommation ECS': [conso_ecs]
                 })
 
@@ -0,0 +1,331 @@
+import io
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import redirect_stdout
+from metrics import Metrics, metrics
+
+# Base des tâches de fond, partagée par les workers de l'interface et les processus des tâches
+JOBS_PATH = "var/jobs_69.sqlite3"
+
+# Nombre de processus exécutant les tâches de fond
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 1))
+
+# Types de tâches exclusifs entre eux : une seule tâche d'un même groupe peut être en cours (les deux écrivent les modèles)
+JOB_GROUPS = {
+    "data": ("data",),
+    "models": ("models", "update_models"),
+    "update_models": ("models", "update_models")
+}
+
+# Intervalle minimal entre deux vérifications de l'annulation d'une tâche (en secondes)
+CANCEL_CHECK_INTERVAL = 1.0
+
+# Intervalle de mise à jour du signal de vie des tâches non terminées (en secondes)
+JOB_HEARTBEAT_INTERVAL = 5
+
+# Durée sans signal de vie après laquelle une tâche non terminée est considérée comme interrompue (en secondes)
+JOB_HEARTBEAT_TIMEOUT = 60
+
+# Statuts d'une tâche qui n'est pas terminée
+ACTIVE_STATUSES = ("queued", "running", "cancelling")
+
+# Libellés des statuts affichés dans l'interface
+STATUS_LABELS = {
+    "queued": "En attente",
+    "running": "En cours",
+    "cancelling": "Annulation en cours",
+    "cancelled": "Annulée",
+    "done": "Terminée",
+    "failed": "Échec"
+}
+
+class JobCancelled(BaseException):
+    """
+    Exception levée dans le processus d'une tâche dont l'annulation a été demandée
+    (hérite de BaseException pour ne pas être interceptée par les traitements d'erreurs des tâches)
+    """
+
+class JobTable:
+    """
+    Table des tâches de fond enregistrée dans une base SQLite, utilisable depuis plusieurs processus
+    """
+
+    # Constructeur de la classe
+    def __init__(self, path=JOBS_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT, status TEXT, message TEXT, error TEXT, "
+                "pid INTEGER, created REAL, started REAL, finished REAL, metrics TEXT, heartbeat REAL)"
+            )
+            # Colonnes ajoutées depuis la création de la table
+            for column in ("metrics TEXT", "heartbeat REAL"):
+                try:
+                    connection.execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+                except sqlite3.OperationalError:
+                    pass
+
+    # Fonction d'ouverture d'une connexion à la base
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    # Fonction de création d'une tâche, refusée si une tâche du même groupe n'est pas terminée
+    def create(self, kind):
+        group = JOB_GROUPS.get(kind, (kind,))
+        connection = self.connect()
+        try:
+            # Verrou en écriture pour que deux demandes simultanées ne créent pas deux tâches
+            connection.execute("BEGIN IMMEDIATE")
+            active = connection.execute(
+                f"SELECT id, heartbeat FROM jobs WHERE kind IN ({','.join('?' * len(group))}) AND status IN ({','.join('?' * len(ACTIVE_STATUSES))})",
+                (*group, *ACTIVE_STATUSES)
+            ).fetchall()
+            for job in active:
+                if job["heartbeat"] is not None and time.time() - job["heartbeat"] < JOB_HEARTBEAT_TIMEOUT:
+                    connection.execute("ROLLBACK")
+                    return None
+                # Tâche sans signal de vie récent : son processus (ou le serveur qui l'a lancée) s'est arrêté sans mettre à jour son statut
+                connection.execute(
+                    "UPDATE jobs SET status = 'failed', error = 'Processus interrompu', finished = ? WHERE id = ?",
+                    (time.time(), job["id"])
+                )
+
+            # Le processus de la tâche n'est connu qu'au démarrage de celle-ci
+            job_id = uuid.uuid4().hex[:12]
+            connection.execute(
+                "INSERT INTO jobs (id, kind, status, message, created, heartbeat) VALUES (?, ?, 'queued', '', ?, ?)",
+                (job_id, kind, time.time(), time.time())
+            )
+            connection.execute("COMMIT")
+            return job_id
+        finally:
+            connection.close()
+
+    # Fonction de mise à jour des champs d'une tâche
+    def update(self, job_id, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self.connect() as connection:
+            connection.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    # Fonction de mise à jour du signal de vie de tâches ayant l'un des statuts donnés
+    def heartbeat(self, job_ids, statuses):
+        if not job_ids:
+            return
+        with self.connect() as connection:
+            connection.execute(
+                f"UPDATE jobs SET heartbeat = ? WHERE id IN ({','.join('?' * len(job_ids))}) AND status IN ({','.join('?' * len(statuses))})",
+                (time.time(), *job_ids, *statuses)
+            )
+
+    # Fonction de récupération d'une tâche
+    def get(self, job_id):
+        with self.connect() as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    # Fonction de récupération de la dernière tâche d'un type
+    def latest(self, kind):
+        with self.connect() as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE kind = ? ORDER BY created DESC LIMIT 1", (kind,)).fetchone()
+        return dict(row) if row else None
+
+    # Fonction de récupération des métriques cumulées des tâches terminées, mesurées dans leurs processus
+    def metrics(self):
+        merged = Metrics()
+        with self.connect() as connection:
+            for row in connection.execute("SELECT metrics FROM jobs WHERE metrics IS NOT NULL"):
+                merged.merge(json.loads(row["metrics"]))
+        return merged
+
+    # Fonction de passage en échec d'une tâche non terminée
+    def fail(self, job_id, error):
+        with self.connect() as connection:
+            connection.execute(
+                f"UPDATE jobs SET status = 'failed', error = ?, finished = ? WHERE id = ? AND status IN ({','.join('?' * len(ACTIVE_STATUSES))})",
+                (error, time.time(), job_id, *ACTIVE_STATUSES)
+            )
+
+    # Fonction de demande d'annulation d'une tâche non terminée
+    def cancel(self, job_id):
+        with self.connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = CASE status WHEN 'queued' THEN 'cancelled' ELSE 'cancelling' END "
+                "WHERE id = ? AND status IN ('queued', 'running')",
+                (job_id,)
+            )
+
+# Fonction de mise à jour régulière du signal de vie des tâches renvoyées par "job_ids", jusqu'au déclenchement de "stop"
+def keep_alive(table, job_ids, statuses, stop):
+    while not stop.wait(JOB_HEARTBEAT_INTERVAL):
+        table.heartbeat(job_ids(), statuses)
+
+# Date de la dernière vérification de l'annulation dans ce processus
+last_cancel_check = 0.0
+
+# Fonction de vérification de l'annulation de la tâche en cours, utilisable dans les processus lancés par la tâche
+# (qui héritent de son identifiant par les variables d'environnement) et au cours des entraînements
+def check_cancelled():
+    global last_cancel_check
+    job_id = os.environ.get("JOB_ID")
+    if job_id is None or time.monotonic() - last_cancel_check < CANCEL_CHECK_INTERVAL:
+        return
+    last_cancel_check = time.monotonic()
+    job = JobTable(os.environ.get("JOBS_PATH", JOBS_PATH)).get(job_id)
+    if job is not None and job["status"] == "cancelling":
+        raise JobCancelled()
+
+class JobOutput(io.TextIOBase):
+    """
+    Sortie standard d'une tâche : chaque message affiché devient la progression de la tâche
+    et permet de vérifier si son annulation a été demandée
+    """
+
+    # Constructeur de la classe
+    def __init__(self, table, job_id):
+        self.table = table
+        self.job_id = job_id
+
+    # Fonction d'écriture d'un message
+    def write(self, text):
+        sys.__stdout__.write(text)
+        message = text.strip()
+        if message and threading.current_thread() is threading.main_thread():
+            self.table.update(self.job_id, message=message)
+            check_cancelled()
+        return len(text)
+
+# Fonction d'actualisation des données de l'API
+def refresh_data():
+    from api import API
+    API().update_data()
+
+# Fonction de réentraînement des modèles de prédiction
+def train_models():
+    from model import Model
+    Model.train_models(None)
+
+# Fonction de mise à jour des modèles de prédiction avec les nouveaux DPE
+def update_models():
+    from model import Model
+    Model.update_models()
+
+# Fonctions exécutées par chaque type de tâche
+JOBS = {
+    "data": refresh_data,
+    "models": train_models,
+    "update_models": update_models
+}
+
+# Fonction d'exécution d'une tâche dans un processus du pool
+def run_job(job_id, kind, path=JOBS_PATH):
+    table = JobTable(path)
+    if table.get(job_id)["status"] != "queued":
+        return
+    table.update(job_id, status="running", pid=os.getpid(), started=time.time(), heartbeat=time.time())
+    stop = threading.Event()
+    threading.Thread(target=keep_alive, args=(table, lambda: [job_id], ("running", "cancelling"), stop), daemon=True).start()
+    # Identifiant transmis aux processus lancés par la tâche pour qu'ils vérifient eux aussi son annulation
+    os.environ["JOB_ID"], os.environ["JOBS_PATH"] = job_id, path
+    # Les métriques du processus ne portent que sur la tâche, pour être transmises à l'interface à la fin de celle-ci
+    metrics.clear()
+    try:
+        with redirect_stdout(JobOutput(table, job_id)):
+            JOBS[kind]()
+        table.update(job_id, status="done", finished=time.time())
+    except JobCancelled:
+        table.update(job_id, status="cancelled", message="Tâche annulée", finished=time.time())
+    except Exception as e:
+        table.update(job_id, status="failed", error=str(e), finished=time.time())
+    finally:
+        stop.set()
+        del os.environ["JOB_ID"], os.environ["JOBS_PATH"]
+        table.update(job_id, metrics=json.dumps(metrics.state()))
+
+class JobRunner:
+    """
+    Exécution des tâches de fond dans un pool de processus local
+    """
+
+    # Constructeur de la classe
+    def __init__(self, workers=JOB_WORKERS, path=JOBS_PATH):
+        self.workers = workers
+        self.path = path
+        self.table = JobTable(path)
+        self.executor = None
+        self.pending = set()
+        self.keeper = None
+        self.lock = threading.Lock()
+
+    # Fonction de récupération des tâches lancées par ce serveur et pas encore terminées
+    def pending_jobs(self):
+        with self.lock:
+            return list(self.pending)
+
+    # Fonction de création du pool, avec des processus démarrés indépendamment du serveur web
+    def create_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    # Fonction de lancement d'une tâche, renvoyant son identifiant ou None si une tâche du même groupe est en cours
+    def submit(self, kind):
+        job_id = self.table.create(kind)
+        if job_id is None:
+            return None
+        with self.lock:
+            try:
+                if self.executor is None:
+                    self.executor = self.create_executor()
+                try:
+                    future = self.executor.submit(run_job, job_id, kind, self.path)
+                except BrokenProcessPool:
+                    # Pool cassé par l'arrêt brutal d'un processus (mémoire insuffisante par exemple) : création d'un nouveau pool
+                    self.executor = self.create_executor()
+                    future = self.executor.submit(run_job, job_id, kind, self.path)
+            except Exception as e:
+                # La tâche ne doit pas rester en attente, ce qui bloquerait son groupe
+                self.table.fail(job_id, f"Lancement impossible : {str(e)}")
+                return job_id
+
+            # Signal de vie des tâches en attente entretenu par le serveur, celui des tâches en cours par leur processus
+            self.pending.add(job_id)
+            if self.keeper is None:
+                self.keeper = threading.Thread(target=keep_alive, args=(self.table, self.pending_jobs, ("queued",), threading.Event()), daemon=True)
+                self.keeper.start()
+        future.add_done_callback(lambda f: self.job_finished(job_id, f))
+        return job_id
+
+    # Fonction appelée à la fin de l'exécution d'une tâche : passage en échec si son processus s'est arrêté brutalement
+    def job_finished(self, job_id, future):
+        with self.lock:
+            self.pending.discard(job_id)
+        error = future.exception()
+        if error is not None:
+            self.table.fail(job_id, f"Processus interrompu : {str(error) or type(error).__name__}")
+
+    # Fonction de description de la dernière tâche d'un type pour l'interface
+    def describe(self, kind):
+        job = self.table.latest(kind)
+        if job is None:
+            return ""
+        elapsed = (job["finished"] or time.time()) - (job["started"] or job["created"])
+        description = f"{STATUS_LABELS[job['status']]} ({elapsed:.0f} s)"
+        if job["status"] == "failed":
+            return f"{description} : {job['error']}"
+        return f"{description} : {job['message']}" if job["message"] else description
+
+    # Fonction d'annulation de la dernière tâche d'un type
+    def cancel(self, kind):
+        job = self.table.latest(kind)
+        if job is not None:
+            self.table.cancel(job["id"])
@@ -0,0 +1,247 @@
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+try:
+    import resource
+except ImportError:
+    # Module disponible uniquement sous Unix : la mémoire résidente n'est pas mesurée sous Windows
+    resource = None
+
+# Activation du profileur par échantillonnage des piles d'appels de tous les threads
+SAMPLING_PROFILER = os.environ.get("SAMPLING_PROFILER", "0") == "1"
+
+# Intervalle entre deux échantillons du profileur (en secondes)
+PROFILER_INTERVAL = float(os.environ.get("PROFILER_INTERVAL", 0.01))
+
+# Bornes des histogrammes de durée (en secondes)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# Bornes des histogrammes de taille des réponses (en octets)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+# Bornes des histogrammes du nombre de lignes parcourues
+ROWS_BUCKETS = (1e2, 1e3, 1e4, 1e5, 1e6, 1e7)
+
+# Histogrammes des métriques, transmis par les processus des tâches de fond
+HISTOGRAMS = ("latency", "payload", "rows", "rss_delta")
+
+# Fonction de lecture de la mémoire résidente du processus (en octets), None si elle n'est pas mesurable
+def resident_memory():
+    try:
+        with open("/proc/self/statm", encoding="utf-8") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        # Sans /proc, la mémoire résidente maximale est la seule disponible
+        if resource is None:
+            return None
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class Histogram:
+    """
+    Histogramme cumulatif au format Prometheus, une série par valeur des étiquettes
+    """
+
+    # Constructeur de la classe
+    def __init__(self, name, help, label, buckets):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self.series = defaultdict(lambda: [[0] * len(buckets), 0, 0.0])
+        self.lock = threading.Lock()
+
+    # Fonction d'enregistrement d'une observation
+    def observe(self, label_value, value):
+        with self.lock:
+            series = self.series[label_value]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += 1
+            series[2] += value
+
+    # Fonction de récupération des séries, sérialisables en JSON
+    def state(self):
+        with self.lock:
+            return {label_value: [list(counts), count, total] for label_value, (counts, count, total) in self.series.items()}
+
+    # Fonction d'ajout des séries d'un autre histogramme (récupérées par la fonction "state")
+    def merge(self, state):
+        with self.lock:
+            for label_value, (counts, count, total) in state.items():
+                series = self.series[label_value]
+                series[0] = [a + b for a, b in zip(series[0], counts)]
+                series[1] += count
+                series[2] += total
+
+    # Fonction de suppression des séries
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+    # Fonction d'export au format texte Prometheus, avec les séries d'autres processus (couples worker, histogramme)
+    def export(self, others=()):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for worker, histogram in ((os.getpid(), self), *others):
+            with histogram.lock:
+                for label_value, (counts, count, total) in sorted(histogram.series.items()):
+                    labels = f'{self.label}="{label_value}",worker="{worker}"'
+                    for bound, bucket_count in zip(self.buckets, counts):
+                        lines.append(f'{self.name}_bucket{{{labels},le="{bound:g}"}} {bucket_count}')
+                    lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+                    lines.append(f"{self.name}_sum{{{labels}}} {total:.6f}")
+                    lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+class Metrics:
+    """
+    Métriques du processus : durées, tailles des réponses, lignes parcourues, variations de mémoire et erreurs
+    des callbacks et des traitements de l'API et des modèles
+    """
+
+    # Constructeur de la classe
+    def __init__(self):
+        self.latency = Histogram("enedis_call_duration_seconds", "Durée des callbacks et des traitements", "name", LATENCY_BUCKETS)
+        self.payload = Histogram("enedis_response_size_bytes", "Taille des réponses des callbacks", "name", SIZE_BUCKETS)
+        self.rows = Histogram("enedis_rows_scanned", "Nombre de lignes parcourues par appel", "name", ROWS_BUCKETS)
+        self.rss_delta = Histogram("enedis_rss_delta_bytes", "Variation de la mémoire résidente par appel", "name", (0, 1e6, 1e7, 1e8, 1e9))
+        self.errors = Counter()
+        self.collectors = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    # Fonction d'ajout d'une source de mesures supplémentaires (fonction renvoyant un dictionnaire nom : valeur)
+    def register_collector(self, prefix, collect):
+        self.collectors.append((prefix, collect))
+
+    # Fonction d'enregistrement du nombre de lignes parcourues par l'appel en cours
+    def add_rows_scanned(self, rows):
+        if getattr(self.local, "rows", None) is not None:
+            self.local.rows += int(rows)
+
+    # Fonction de mesure d'un appel, les appels imbriqués étant mesurés séparément
+    def call(self, name, func, *args, **kwargs):
+        previous_rows = getattr(self.local, "rows", None)
+        self.local.rows = 0
+        rss = resident_memory()
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            with self.lock:
+                self.errors[name] += 1
+            raise
+        finally:
+            self.latency.observe(name, time.perf_counter() - start)
+            if rss is not None:
+                self.rss_delta.observe(name, resident_memory() - rss)
+            if self.local.rows:
+                self.rows.observe(name, self.local.rows)
+            self.local.rows = previous_rows
+
+    # Fonction de récupération des mesures enregistrées, sérialisables en JSON pour être transmises par un autre processus
+    def state(self):
+        with self.lock:
+            errors = dict(self.errors)
+        return {**{name: getattr(self, name).state() for name in HISTOGRAMS}, "errors": errors}
+
+    # Fonction d'ajout des mesures d'un autre processus (récupérées par la fonction "state")
+    def merge(self, state):
+        for name in HISTOGRAMS:
+            getattr(self, name).merge(state.get(name, {}))
+        with self.lock:
+            self.errors.update(state.get("errors", {}))
+
+    # Fonction de suppression des mesures enregistrées
+    def clear(self):
+        for name in HISTOGRAMS:
+            getattr(self, name).clear()
+        with self.lock:
+            self.errors.clear()
+
+    # Fonction d'export de l'ensemble des métriques au format texte Prometheus,
+    # avec les mesures d'autres processus (couples worker, métriques), comme celles des tâches de fond
+    def export(self, others=()):
+        lines = []
+        for name in HISTOGRAMS:
+            lines.extend(getattr(self, name).export([(worker, getattr(other, name)) for worker, other in others]))
+
+        lines += ["# HELP enedis_call_errors_total Nombre d'appels terminés par une erreur", "# TYPE enedis_call_errors_total counter"]
+        for worker, source in ((os.getpid(), self), *others):
+            with source.lock:
+                lines += [f'enedis_call_errors_total{{name="{name}",worker="{worker}"}} {count}' for name, count in sorted(source.errors.items())]
+
+        rss = resident_memory()
+        if rss is not None:
+            lines += ["# TYPE enedis_resident_memory_bytes gauge", f'enedis_resident_memory_bytes{{worker="{os.getpid()}"}} {rss}']
+        for prefix, collect in self.collectors:
+            for key, value in collect().items():
+                lines += [f"# TYPE enedis_{prefix}_{key} gauge", f'enedis_{prefix}_{key}{{worker="{os.getpid()}"}} {value}']
+        return "\n".join(lines) + "\n"
+
+# Métriques du processus
+metrics = Metrics()
+
+# Décorateur de mesure d'une fonction
+def timed(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return metrics.call(name, func, *args, **kwargs)
+        return wrapper
+    return decorator
+
+class SamplingProfiler:
+    """
+    Profileur relevant à intervalle régulier la pile d'appels de chaque thread,
+    exportée au format "folded" (une pile par ligne avec son nombre d'échantillons) pour les flame graphs
+    """
+
+    # Constructeur de la classe
+    def __init__(self, interval=PROFILER_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.thread = None
+        self.running = False
+        self.lock = threading.Lock()
+
+    # Fonction de démarrage du profileur
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, name="sampling-profiler", daemon=True)
+        self.thread.start()
+
+    # Fonction d'arrêt du profileur
+    def stop(self):
+        self.running = False
+
+    # Fonction de relevé des piles d'appels
+    def sample(self):
+        own_id = threading.get_ident()
+        while self.running:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_firstlineno})")
+                    frame = frame.f_back
+                with self.lock:
+                    self.stacks[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    # Fonction d'export des piles d'appels échantillonnées
+    def export(self):
+        with self.lock:
+            return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+# Profileur du processus, démarré si le mode est activé
+profiler = SamplingProfiler()
+if SAMPLING_PROFILER:
+    profiler.start()
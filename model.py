@@ -1,80 +1,255 @@
 from api import API
+from storage import get_storage, tmp_name
+import features
+from metrics import metrics, timed
+from jobs import check_cancelled
 
+import copy
+import io
 import joblib
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+import numpy as np
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.neural_network import MLPClassifier, MLPRegressor
 from sklearn.metrics import accuracy_score, mean_squared_error
 
+# Chemins des fichiers des modèles, du scaler et des noms des variables
+MODEL_PATHS = {
+    "DPE": "model/DPE_model.pkl",
+    "conso": "model/conso_model.pkl",
+    "scaler": "model/scaler.pkl",
+    "feature_names": "model/feature_names.pkl"
+}
+
+# Fichier de version des modèles, écrit après l'enregistrement de tous les fichiers
+VERSION_PATH = "model/version.txt"
+
+# Chemin des données sur le niveau de vie
+LIVING_STANDARDS_PATH = "assets/living_standards_69.csv"
+
+# Informations sur les données ayant servi à l'entraînement des modèles enregistrés
+TRAINING_PATH = "model/training.json"
+
+# Entraînement simultané des deux modèles dans des processus séparés
+TRAINING_PARALLEL = os.environ.get("TRAINING_PARALLEL", "1") == "1"
+
+# Nombre d'anciens DPE rejoués avec les nouveaux DPE lors d'une mise à jour incrémentale des modèles
+REPLAY_SIZE = 20000
+
+# Nombre de passages sur les données lors d'une mise à jour incrémentale des modèles
+INCREMENTAL_EPOCHS = 5
+
+# Paramètres communs des réseaux de neurones, l'entraînement s'arrêtant lorsque le score de validation ne progresse plus
+MLP_PARAMS = {
+    "hidden_layer_sizes": (100, 50),
+    "learning_rate_init": 0.001,
+    "max_iter": 300,
+    "tol": 0.0001,
+    "random_state": 0,
+    "early_stopping": True,
+    "validation_fraction": 0.1,
+    "n_iter_no_change": 10
+}
+
+class ModelRegistry:
+    """
+    Registre chargeant les modèles une seule fois par processus et les remplaçant lorsqu'une nouvelle version est enregistrée
+    """
+
+    # Constructeur de la classe
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = (None, None)
+
+    # Fonction de récupération de la version des fichiers enregistrés
+    def stored_version(self):
+        try:
+            with open(VERSION_PATH, encoding="utf-8") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            # Sans fichier de version, les dates de modification des fichiers servent de version
+            return tuple(os.stat(path).st_mtime_ns for path in [*MODEL_PATHS.values(), LIVING_STANDARDS_PATH])
+
+    # Fonction de chargement des modèles, du scaler, des noms des variables et des données sur le niveau de vie
+    def load(self):
+        artifacts = {name: joblib.load(path) for name, path in MODEL_PATHS.items()}
+        artifacts["living_standards"] = pd.read_csv(LIVING_STANDARDS_PATH, sep='|')
+        return artifacts
+
+    # Fonction de récupération des modèles, rechargés si une nouvelle version est disponible
+    def get(self):
+        version = self.stored_version()
+        if self.current[0] != version:
+            with self.lock:
+                if self.current[0] != version:
+                    # Remplacement atomique du couple (version, modèles)
+                    self.current = (version, self.load())
+        return self.current[1]
+
+    # Fonction d'enregistrement d'une nouvelle version des fichiers
+    def save(self, artifacts):
+        for name, obj in artifacts.items():
+            tmp_path = tmp_name(MODEL_PATHS[name])
+            joblib.dump(obj, tmp_path)
+            os.replace(tmp_path, MODEL_PATHS[name])
+
+        tmp_path = tmp_name(VERSION_PATH)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(str(time.time_ns()))
+        os.replace(tmp_path, VERSION_PATH)
+
+# Registre des modèles du processus
+registry = ModelRegistry()
+
+class EpochLog(io.TextIOBase):
+    """
+    Sortie d'un entraînement affichant chaque itération du réseau de neurones avec sa durée
+    """
+
+    # Constructeur de la classe
+    def __init__(self, name):
+        self.name = name
+        self.last = time.perf_counter()
+
+    # Fonction d'écriture d'un message
+    def write(self, text):
+        for line in text.splitlines():
+            if line.startswith("Iteration"):
+                now = time.perf_counter()
+                sys.__stdout__.write(f"[{self.name}] {line} ({now - self.last:.2f} s)\n")
+                self.last = now
+        sys.__stdout__.flush()
+        # Arrêt de l'entraînement si la tâche qui l'a lancé a été annulée, y compris dans un processus séparé
+        check_cancelled()
+        return len(text)
+
+# Fonction d'entraînement d'un modèle, exécutable dans un processus séparé
+def fit_model(name, estimator, X, y):
+    start = time.perf_counter()
+    estimator.set_params(verbose=True)
+    with redirect_stdout(EpochLog(name)):
+        estimator.fit(X, y)
+    estimator.set_params(verbose=False)
+    print(f"[{name}] {estimator.n_iter_} itérations en {time.perf_counter() - start:.1f} s")
+    return estimator
+
+# Fonction de réinitialisation de l'arrêt anticipé d'un modèle enregistré avant la reprise de son entraînement :
+# sans elle, le compteur et le meilleur score de validation du précédent entraînement l'arrêteraient dès les premières itérations
+def reset_early_stopping(estimator):
+    estimator._no_improvement_count = 0
+    estimator.validation_scores_ = []
+    estimator.best_validation_score_ = -np.inf
+    estimator.best_loss_ = None
+    estimator._best_coefs = [coefs.copy() for coefs in estimator.coefs_]
+    estimator._best_intercepts = [intercepts.copy() for intercepts in estimator.intercepts_]
+    return estimator
+
+# Fonction de tirage du jeu de test parmi les lignes ajoutées après les "start" premières lignes des données stockées
+def held_out_rows(index, start, test_size=0.30):
+    return train_test_split(index[index >= start], test_size=test_size, random_state=0)[1]
+
+# Fonction de récupération du nombre de lignes des données stockées déjà utilisées par chaque modèle
+# (un seul nombre pour les deux modèles dans les informations enregistrées par les versions précédentes)
+def trained_rows(info):
+    rows = info["stored_rows"]
+    return dict(rows) if isinstance(rows, dict) else {"DPE": rows, "conso": rows}
+
+# Fonction de lecture des informations sur l'entraînement des modèles enregistrés
+def load_training_info():
+    try:
+        with open(TRAINING_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+# Fonction d'enregistrement des informations sur l'entraînement des modèles
+def save_training_info(info):
+    tmp_path = tmp_name(TRAINING_PATH)
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(info, f)
+    os.replace(tmp_path, TRAINING_PATH)
+
 class Model:
-    def train_models(df):
+    @timed("model.train_models")
+    def train_models(df, parallel=TRAINING_PARALLEL, warm_start=True):
         """
         Cette fonction permet de créer un modèle de classification de la classe énergétique et un modèle de régression de la consommation totale.
+        Les deux modèles sont entraînés simultanément si parallel est vrai, et repartent des modèles enregistrés si warm_start est vrai
+        et que seuls de nouveaux DPE ont été ajoutés depuis leur entraînement.
         """
 
         # Chargement des données locales
-        df = pd.read_csv('assets/data_69.csv', sep='|')
-        df_ls = pd.read_csv('assets/living_standards_69.csv', sep='|')
+        storage = get_storage()
+        df = storage.load()
+        df_ls = pd.read_csv(LIVING_STANDARDS_PATH, sep='|')
+        data_version = storage.version()
+        stored_rows = len(df)
+        metrics.add_rows_scanned(stored_rows)
 
-        # Mise en forme des données
-        del_col = ['Nom commune', 'Date réception DPE', "Latitude", "Longitude", "Date_réception_DPE_graph"]
-        df.drop(columns=del_col, inplace=True, errors='ignore')
-        df = df.dropna()
+        # Préparation des variables explicatives et des variables cibles
+        X, y_class, y_reg = Model.training_frame(df, df_ls)
 
-        # Ajout des données sur le niveau de vie ou la moyenne si la commune n'est pas renseignée
-        ls_mean = df_ls["Médiane niveau vie"].mean()
-        df = pd.merge(df, df_ls, how='left', on='Code postal')
-        df["Médiane niveau vie"] = df["Médiane niveau vie"].fillna(ls_mean)
+        # Sauvegarde des noms des colonnes
+        feature_names = X.columns
 
-        # Préparation des données pour le modèle
-        df = pd.get_dummies(df, columns=[
-            'Période construction', 
-            'Type bâtiment', 
-            'Classe altitude', 
-            'Type énergie ECS', 
-            'Type énergie chauffage'
-        ])
+        # Reprise des modèles enregistrés si les données n'ont été que complétées depuis leur entraînement (mêmes variables et mêmes classes)
+        info = load_training_info()
+        previous = Model.warm_start_artifacts(info, data_version, feature_names, y_class) if warm_start else None
+        if previous is not None:
+            print("Reprise de l'entraînement à partir des modèles enregistrés")
+            scaler = previous["scaler"]
+            X_scaled = scaler.transform(X)
+            classifier = reset_early_stopping(previous["DPE"].set_params(**MLP_PARAMS, warm_start=True))
+            regressor = reset_early_stopping(previous["conso"].set_params(**MLP_PARAMS, warm_start=True))
 
-        # Définition des variables explicatives et de la variable cible
-        y_class = df["Étiquette DPE"]
-        y_reg = df["Consommation totale"]
-        X = df.drop(columns=["Étiquette DPE", "Consommation totale"])
+            # Jeu de test tiré des seuls DPE ajoutés depuis l'entraînement des modèles enregistrés, qu'ils n'ont jamais vus
+            test = X.index.isin(held_out_rows(X.index, min(trained_rows(info).values())))
+            X_train, X_test = X_scaled[~test], X_scaled[test]
+            y_class_train, y_class_test, y_reg_train, y_reg_test = y_class[~test], y_class[test], y_reg[~test], y_reg[test]
+        else:
+            # Normalisation des données
+            scaler = StandardScaler()
+            X_scaled = scaler.fit_transform(X)
+            classifier = MLPClassifier(**MLP_PARAMS)
+            regressor = MLPRegressor(**MLP_PARAMS)
 
-        # Sauvegarde des noms des colonnes
-        feature_names = X.columns
+            # Séparation des données en jeu d'entraînement et jeu de test
+            X_train, X_test, y_class_train, y_class_test, y_reg_train, y_reg_test = train_test_split(
+                X_scaled, y_class, y_reg, test_size=0.30, stratify=y_class, random_state=0
+            )
 
-        # Normalisation des données
-        scaler = StandardScaler()
-        X_scaled = scaler.fit_transform(X)
-
-        # Séparation des données en jeu d'entraînement et jeu de test
-        X_train, X_test, y_class_train, y_class_test, y_reg_train, y_reg_test = train_test_split(
-            X_scaled, y_class, y_reg, test_size=0.30, stratify=y_class, random_state=0
-        )
-
-        # Création et entraînement du modèle de classification
-        classifier = MLPClassifier(
-            hidden_layer_sizes=(100, 50),
-            learning_rate_init=0.001,
-            max_iter=300,
-            tol=0.0001,
-            random_state=0,
-        )
-        classifier.fit(X_train, y_class_train)
-        
-        # Création et entraînement du modèle de régression
-        regressor = MLPRegressor(
-            random_state=0, hidden_layer_sizes=(100, 50), 
-            learning_rate_init=0.001, max_iter=300, tol=0.0001
-        )
-        regressor.fit(X_train, y_reg_train)
+        # Entraînement du modèle de classification et du modèle de régression
+        if parallel:
+            with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn")) as executor:
+                classifier_future = executor.submit(fit_model, "classification", classifier, X_train, y_class_train)
+                regressor_future = executor.submit(fit_model, "régression", regressor, X_train, y_reg_train)
+                classifier, regressor = classifier_future.result(), regressor_future.result()
+        else:
+            classifier = fit_model("classification", classifier, X_train, y_class_train)
+            regressor = fit_model("régression", regressor, X_train, y_reg_train)
+        classifier.set_params(warm_start=False)
+        regressor.set_params(warm_start=False)
 
         # Sauvegarde des modèles, du scaler et des noms des variables
-        joblib.dump(classifier, 'model/DPE_model.pkl')
-        joblib.dump(regressor, 'model/conso_model.pkl')
-        joblib.dump(scaler, 'model/scaler.pkl')
-        joblib.dump(feature_names, 'model/feature_names.pkl')
+        registry.save({
+            "DPE": classifier,
+            "conso": regressor,
+            "scaler": scaler,
+            "feature_names": feature_names
+        })
+        save_training_info({
+            "data_base": data_version["base"] if data_version else None,
+            "stored_rows": {"DPE": stored_rows, "conso": stored_rows}
+        })
 
         # Évaluation du modèle de classification
         y_class_pred = classifier.predict(X_test)
@@ -86,128 +261,208 @@ class Model:
         mse = mean_squared_error(y_reg_test, y_reg_pred)
         print(f"Erreur quadratique moyenne du modèle de régression : {mse:.2f}")
 
-    def predict_DPE(data):
+    def training_frame(df, df_ls, feature_names=None):
         """
-        Cette fonction permet de faire une prédiction de la classe énergétique.
+        Cette fonction permet de préparer les variables explicatives et les variables cibles à partir des données stockées.
         """
 
-        # Chargement du modèle, du scaler, et des noms des variables
-        model = joblib.load('model/DPE_model.pkl')
-        scaler = joblib.load('model/scaler.pkl')
-        feature_names = joblib.load('model/feature_names.pkl')
+        # Mise en forme des données
+        del_col = ['N°DPE', 'Nom commune', 'Date réception DPE', "Latitude", "Longitude", "Date_réception_DPE_graph"]
+        df = df.drop(columns=del_col, errors='ignore')
+        df = df.dropna()
+
+        # Ajout des données sur le niveau de vie ou la moyenne si la commune n'est pas renseignée,
+        # les lignes gardant leur position dans les données stockées pour distinguer les DPE ajoutés depuis un entraînement
+        df = features.add_living_standards(df, df_ls).set_axis(df.index)
+
+        # Préparation des données pour le modèle
+        df = features.encode(df)
+
+        # Définition des variables explicatives et de la variable cible
+        y_class = df["Étiquette DPE"]
+        y_reg = df["Consommation totale"]
+        X = df.drop(columns=["Étiquette DPE", "Consommation totale"])
+        if feature_names is not None:
+            X = X.reindex(columns=feature_names, fill_value=0)
+        return X, y_class, y_reg
+
+    @timed("model.update_models")
+    def update_models(df=None, replay_size=REPLAY_SIZE, epochs=INCREMENTAL_EPOCHS):
+        """
+        Cette fonction permet de mettre à jour les modèles enregistrés avec les DPE ajoutés depuis leur entraînement et un échantillon d'anciens DPE,
+        le scaler restant inchangé. Chaque modèle mis à jour n'est conservé que s'il ne régresse pas sur un jeu de test.
+        """
+
+        # Une mise à jour n'est possible que si les données ont été uniquement complétées depuis le dernier entraînement
+        storage = get_storage()
+        data_version = storage.version()
+        info = load_training_info()
+        if info is None or data_version is None or info["data_base"] != data_version["base"] or "stored_rows" not in info:
+            print("Les données ont changé depuis le dernier entraînement : réentraînement complet des modèles")
+            return Model.train_models(None)
+
+        # Nouveaux DPE (depuis le modèle le moins à jour) et échantillon d'anciens DPE rejoués pour limiter l'oubli des données d'entraînement
+        seen = trained_rows(info)
+        df = storage.load()
+        stored_rows = len(df)
+        start = min(seen.values())
+        new_rows = df.iloc[start:]
+        if new_rows.empty:
+            print("Aucun nouveau DPE depuis le dernier entraînement")
+            return
+        old_rows = df.iloc[:start]
+        replay = old_rows.sample(min(replay_size, len(old_rows)), random_state=data_version["number"])
+        print(f"Mise à jour des modèles avec {len(new_rows)} nouveaux DPE et {len(replay)} anciens DPE")
+
+        # Préparation des variables avec le scaler et les variables des modèles enregistrés
+        artifacts = registry.load()
+        current = {"DPE": artifacts["DPE"], "conso": artifacts["conso"]}
+        X, y_class, y_reg = Model.training_frame(pd.concat([new_rows, replay]), artifacts["living_standards"], artifacts["feature_names"])
+        known = y_class.isin(current["DPE"].classes_)
+        X, y_class, y_reg = X[known], y_class[known], y_reg[known]
+        if np.count_nonzero(X.index >= start) < 2:
+            print("Nouveaux DPE inexploitables (valeurs manquantes ou classes inconnues) : modèles inchangés")
+            return
+        X_scaled = artifacts["scaler"].transform(X)
+
+        # Jeu de test tiré des seuls nouveaux DPE, les anciens DPE rejoués servant uniquement à l'entraînement
+        test = X.index.isin(held_out_rows(X.index, start))
+        X_train = X_scaled[~test]
+        targets = {"DPE": y_class, "conso": y_reg}
+
+        # Passages successifs sur les données d'entraînement mélangées, pour les modèles n'ayant pas vu tous les DPE
+        # (l'arrêt anticipé n'est pas compatible avec partial_fit, le nombre de passages étant fixé)
+        candidates = {
+            name: copy.deepcopy(estimator).set_params(early_stopping=False)
+            for name, estimator in current.items() if seen[name] < stored_rows
+        }
+        for candidate in candidates.values():
+            # Les modèles entraînés avec arrêt anticipé n'ont pas de meilleure perte d'entraînement enregistrée
+            if candidate.best_loss_ is None:
+                candidate.best_loss_ = np.inf
+        rng = np.random.default_rng(data_version["number"])
+        for epoch in range(epochs):
+            start_time = time.perf_counter()
+            order = rng.permutation(len(X_train))
+            for name, candidate in candidates.items():
+                candidate.partial_fit(X_train[order], targets[name][~test].iloc[order])
+            print(f"Passage {epoch + 1}/{epochs} ({time.perf_counter() - start_time:.2f} s)")
+
+        # Comparaison des modèles enregistrés et des modèles mis à jour sur les DPE de test que chaque modèle enregistré n'a jamais vus
+        scorers = {"DPE": accuracy_score, "conso": lambda y_true, y_pred: -mean_squared_error(y_true, y_pred)}
+        scores = {}
+        for name in candidates:
+            unseen = test & (X.index >= seen[name])
+            if unseen.any():
+                scores[name] = [scorers[name](targets[name][unseen], model.predict(X_scaled[unseen])) for model in (current[name], candidates[name])]
+        if "DPE" in scores:
+            print(f"Précision du modèle de classification : {scores['DPE'][0]:.2f} -> {scores['DPE'][1]:.2f}")
+        if "conso" in scores:
+            print(f"Erreur quadratique moyenne du modèle de régression : {-scores['conso'][0]:.2f} -> {-scores['conso'][1]:.2f}")
+
+        # Un modèle mis à jour est retenu s'il est au moins aussi bon que le modèle enregistré
+        accepted = {name: candidates[name] for name, (before, after) in scores.items() if after >= before}
+        rejected = [name for name in candidates if name not in accepted]
+        if rejected:
+            print(f"Modèles mis à jour non retenus (moins bons que les modèles enregistrés sur le jeu de test) : {', '.join(rejected)}")
+        if not accepted:
+            return
+
+        # Seuls les modèles retenus sont considérés comme ayant utilisé les nouveaux DPE
+        registry.save({name: model.set_params(early_stopping=True) for name, model in accepted.items()})
+        seen.update({name: stored_rows for name in accepted})
+        save_training_info({"data_base": data_version["base"], "stored_rows": seen})
+        print(f"Modèles mis à jour : {', '.join(accepted)}")
+
+    def warm_start_artifacts(info, data_version, feature_names, y_class):
+        """
+        Cette fonction permet de récupérer les modèles enregistrés s'ils peuvent servir de point de départ à l'entraînement.
+        """
+
+        # Les données doivent avoir été uniquement complétées depuis le dernier entraînement
+        if info is None or data_version is None or info["data_base"] != data_version["base"] or "stored_rows" not in info:
+            return None
+
+        # Les modèles repris sont évalués sur des DPE ajoutés depuis leur entraînement, qui doivent donc être assez nombreux
+        if np.count_nonzero(y_class.index >= min(trained_rows(info).values())) < 2:
+            return None
+
+        # Chargement d'une copie des modèles, ceux du registre restant utilisés pour les prédictions
+        try:
+            artifacts = registry.load()
+        except FileNotFoundError:
+            return None
+        if list(artifacts["feature_names"]) != list(feature_names) or set(artifacts["DPE"].classes_) != set(y_class.unique()):
+            return None
+        return artifacts
+
+    def prepare_features(data, artifacts):
+        """
+        Cette fonction permet de préparer les variables explicatives normalisées d'un ensemble de logements.
+        """
+
+        data = data.copy()
+        data['Code postal'] = data['Code postal'].astype(str)
 
         # Transformation de l'information "Année de construction" en "Période de construction"
-        data['Période construction'] = data['Période construction'].apply(lambda x: 
-            'avant 1948' if x < 1948 else
-            '1948-1974' if 1948 <= x <= 1974 else
-            '1975-1977' if 1975 <= x <= 1977 else
-            '1978-1982' if 1978 <= x <= 1982 else
-            '1983-1988' if 1983 <= x <= 1988 else
-            '1989-2000' if 1989 <= x <= 2000 else
-            '2001-2005' if 2001 <= x <= 2005 else
-            '2006-2012' if 2006 <= x <= 2012 else
-            '2013-2021' if 2013 <= x <= 2021 else
-            'Après 2021'
-        )
-
-        # Récupération de l'altitude de la commune
-        latitude, longitude = API().get_coordinates(data["Code postal"])
-        if latitude and longitude:
-            altitude = API.get_altitude(latitude, longitude)
-            if altitude is not None:
-                if altitude < 400:
-                    data["Classe altitude"] = "inférieur à 400m"
-                elif altitude >= 400 and altitude <= 800:
-                    data["Classe altitude"] = "400-800m"
-                else:
-                    data["Classe altitude"] = "supérieur à 800m"
-                
-            else:
-                data["Classe altitude"] = "inférieur à 400m"
-        else:
-            data["Classe altitude"] = "inférieur à 400m"
+        data['Période construction'] = features.construction_period(data['Période construction']).values
+
+        # Récupération de la classe d'altitude, une seule fois par code postal
+        api = API()
+        altitude_classes = {code: api.get_altitude_class(code) for code in data['Code postal'].unique()}
+        data["Classe altitude"] = data['Code postal'].map(altitude_classes)
 
         # Ajout des données sur le niveau de vie
-        df_ls = pd.read_csv('assets/living_standards_69.csv', sep='|')
-        df_ls['Code postal'] = df_ls['Code postal'].astype(str)
-        ls_mean = df_ls["Médiane niveau vie"].mean()
-        data = pd.merge(data, df_ls, how='left', on='Code postal')
-        data["Médiane niveau vie"] = data["Médiane niveau vie"].fillna(ls_mean)
+        data = features.add_living_standards(data, artifacts["living_standards"])
         
         # Application des mêmes transformations que lors de l'entraînement
-        data = pd.get_dummies(data, columns=[
-            'Période construction', 
-            'Type bâtiment', 
-            'Classe altitude', 
-            'Type énergie ECS', 
-            'Type énergie chauffage'
-        ])
-        data = data.reindex(columns=feature_names, fill_value=0)
-        data = scaler.transform(data)
+        data = features.encode(data, artifacts["feature_names"])
+        return artifacts["scaler"].transform(data)
+
+    @timed("model.predict_DPE")
+    def predict_DPE(data):
+        """
+        Cette fonction permet de faire une prédiction de la classe énergétique.
+        """
+
+        # Récupération du modèle, du scaler, et des noms des variables
+        artifacts = registry.get()
 
         # Prédiction
-        prediction = model.predict(data)
+        prediction = artifacts["DPE"].predict(Model.prepare_features(data, artifacts))
         return prediction[0]
     
+    @timed("model.predict_conso")
     def predict_conso(data):
         """
         Cette fonction permet de faire une prédiction de la consommation totale.
         """
 
-        # Chargement du modèle, du scaler, et des noms des variables
-        model = joblib.load('model/conso_model.pkl')
-        scaler = joblib.load('model/scaler.pkl')
-        feature_names = joblib.load('model/feature_names.pkl')
+        # Récupération du modèle, du scaler, et des noms des variables
+        artifacts = registry.get()
 
-        # Transformation de l'information "Année de construction" en "Période de construction"
-        data['Période construction'] = data['Période construction'].apply(lambda x: 
-            'avant 1948' if x < 1948 else
-            '1948-1974' if 1948 <= x <= 1974 else
-            '1975-1977' if 1975 <= x <= 1977 else
-            '1978-1982' if 1978 <= x <= 1982 else
-            '1983-1988' if 1983 <= x <= 1988 else
-            '1989-2000' if 1989 <= x <= 2000 else
-            '2001-2005' if 2001 <= x <= 2005 else
-            '2006-2012' if 2006 <= x <= 2012 else
-            '2013-2021' if 2013 <= x <= 2021 else
-            'Après 2021'
-        )
-
-        # Récupération de l'altitude de la commune
-        latitude, longitude = API().get_coordinates(data["Code postal"])
-        if latitude and longitude:
-            altitude = API.get_altitude(latitude, longitude)
-            if altitude is not None:
-                if altitude < 400:
-                    data["Classe altitude"] = "inférieur à 400m"
-                elif altitude >= 400 and altitude <= 800:
-                    data["Classe altitude"] = "400-800m"
-                else:
-                    data["Classe altitude"] = "supérieur à 800m"
-                
-            else:
-                data["Classe altitude"] = "inférieur à 400m"
-        else:
-            data["Classe altitude"] = "inférieur à 400m"
+        # Prédiction
+        prediction = artifacts["conso"].predict(Model.prepare_features(data, artifacts))
+        return prediction[0]
 
-        # Ajout des données sur le niveau de vie
-        df_ls = pd.read_csv('assets/living_standards_69.csv', sep='|')
-        df_ls['Code postal'] = df_ls['Code postal'].astype(str)
-        ls_mean = df_ls["Médiane niveau vie"].mean()
-        data = pd.merge(data, df_ls, how='left', on='Code postal')
-        data["Médiane niveau vie"] = data["Médiane niveau vie"].fillna(ls_mean)
-        
-        # Application des mêmes transformations que lors de l'entraînement
-        data = pd.get_dummies(data, columns=[
-            'Période construction', 
-            'Type bâtiment', 
-            'Classe altitude', 
-            'Type énergie ECS', 
-            'Type énergie chauffage'
-        ])
-        data = data.reindex(columns=feature_names, fill_value=0)
-        data = scaler.transform(data)
+    @timed("model.predict_batch")
+    def predict_batch(data):
+        """
+        Cette fonction permet de prédire en une seule passe la classe énergétique, les probabilités de chaque classe et la consommation totale d'un ensemble de logements.
+        """
 
-        # Prédiction
-        prediction = model.predict(data)
-        return prediction[0]
\ No newline at end of file
+        # Récupération des modèles, du scaler, et des noms des variables
+        artifacts = registry.get()
+        classifier = artifacts["DPE"]
+
+        # Préparation des variables et normalisation pour l'ensemble des logements
+        X = Model.prepare_features(data, artifacts)
+
+        # Prédiction des probabilités, la classe prédite étant la plus probable
+        probabilities = classifier.predict_proba(X)
+        predictions = pd.DataFrame(probabilities, columns=[f"Probabilité {c}" for c in classifier.classes_], index=data.index)
+        predictions.insert(0, "Étiquette DPE prédite", classifier.classes_[probabilities.argmax(axis=1)])
+
+        # Prédiction de la consommation totale
+        predictions["Consommation totale prédite"] = artifacts["conso"].predict(X)
+        return predictions
\ No newline at end of file
@@ -0,0 +1,35 @@
+from model import Model
+
+import argparse
+import pandas as pd
+
+# Fonction de lecture d'un fichier de logements (CSV ou Parquet)
+def read_dwellings(path, sep):
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    return pd.read_csv(path, sep=sep)
+
+def main():
+    """
+    Fonction de prédiction en lot de la classe énergétique et de la consommation d'un fichier de logements
+    """
+
+    parser = argparse.ArgumentParser(description="Prédiction en lot de la classe énergétique et de la consommation totale de logements")
+    parser.add_argument("input", help="fichier CSV ou Parquet des logements, avec les mêmes colonnes que le formulaire de prédiction")
+    parser.add_argument("-o", "--output", default="predictions.csv", help="fichier de sortie CSV ou Parquet (par défaut : predictions.csv)")
+    parser.add_argument("--sep", default="|", help="séparateur des fichiers CSV (par défaut : |)")
+    args = parser.parse_args()
+
+    # Prédiction de l'ensemble des logements en une seule passe
+    data = read_dwellings(args.input, args.sep)
+    predictions = pd.concat([data, Model.predict_batch(data)], axis=1)
+
+    # Sauvegarde des prédictions
+    if args.output.endswith(".parquet"):
+        predictions.to_parquet(args.output, index=False)
+    else:
+        predictions.to_csv(args.output, index=False, sep=args.sep, encoding="utf-8")
+    print(f"{len(predictions)} logements prédits : résultats enregistrés dans {args.output}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
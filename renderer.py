@@ -0,0 +1,144 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from storage import tmp_name
+
+# Dossier du cache des images rendues, partagé par les workers de l'interface (hors du dossier "assets" servi publiquement)
+RENDER_CACHE_PATH = "var/renders_69"
+
+# Nombre maximal d'images conservées dans le cache
+RENDER_CACHE_ENTRIES = int(os.environ.get("RENDER_CACHE_ENTRIES", 200))
+
+# Nombre de processus de rendu, chacun gardant son processus kaleido ouvert
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", 1))
+
+# Durée maximale d'un rendu avant de le considérer comme perdu (en secondes)
+RENDER_TIMEOUT = int(os.environ.get("RENDER_TIMEOUT", 120))
+
+# Formats d'image disponibles et types MIME correspondants
+RENDER_FORMATS = {
+    "png": "image/png",
+    "svg": "image/svg+xml",
+    "pdf": "application/pdf",
+    "webp": "image/webp"
+}
+
+# Bornes des dimensions (en pixels) et de l'échelle des images
+MIN_SIZE, MAX_SIZE = 100, 4000
+MAX_SCALE = 4
+
+# Fonction de démarrage d'un processus de rendu : le processus kaleido est lancé une fois puis réutilisé
+def start_renderer():
+    import plotly.io as pio
+    pio.to_image({"data": [], "layout": {}}, format="png", width=MIN_SIZE, height=MIN_SIZE, validate=False)
+
+# Fonction de rendu d'une figure dans un processus de rendu, l'image ou l'erreur étant écrite dans le cache
+def render_image(fig_json, image_format, width, height, scale, path):
+    import plotly.io as pio
+    try:
+        image = pio.to_image(json.loads(fig_json), format=image_format, width=width, height=height, scale=scale, validate=False)
+        tmp_path = tmp_name(path)
+        with open(tmp_path, "wb") as f:
+            f.write(image)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        with open(f"{path}.error", "w", encoding="utf-8") as f:
+            f.write(str(e))
+
+class Renderer:
+    """
+    Rendu des figures en images statiques dans un pool de processus, hors des requêtes de l'interface,
+    avec un cache des images indexé par le contenu de la figure et les paramètres du rendu
+    """
+
+    # Constructeur de la classe
+    def __init__(self, workers=RENDER_WORKERS, path=RENDER_CACHE_PATH, max_entries=RENDER_CACHE_ENTRIES):
+        self.workers = workers
+        self.path = path
+        self.max_entries = max_entries
+        self.executor = None
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    # Fonction de normalisation des paramètres du rendu (dimensions bornées, None pour celles de la figure)
+    def options(self, image_format, width=None, height=None, scale=1):
+        image_format = image_format if image_format in RENDER_FORMATS else "png"
+        width = min(max(int(width), MIN_SIZE), MAX_SIZE) if width else None
+        height = min(max(int(height), MIN_SIZE), MAX_SIZE) if height else None
+        scale = min(max(float(scale or 1), 1), MAX_SCALE)
+        return image_format, width, height, scale
+
+    # Fonction de calcul de la clé d'une image à partir du contenu de la figure et des paramètres du rendu
+    def key(self, fig_json, image_format, width, height, scale):
+        digest = hashlib.sha256(fig_json.encode("utf-8"))
+        digest.update(json.dumps([image_format, width, height, scale]).encode("utf-8"))
+        return digest.hexdigest()[:32]
+
+    # Fonction du chemin d'une image du cache
+    def image_path(self, key, image_format):
+        return os.path.join(self.path, f"{key}.{image_format}")
+
+    # Fonction de lancement du rendu d'une figure, renvoyant la clé de l'image (sans rendu si elle est déjà dans le cache)
+    def submit(self, fig, image_format="png", width=None, height=None, scale=1):
+        image_format, width, height, scale = self.options(image_format, width, height, scale)
+        fig_json = fig.to_json()
+        key = self.key(fig_json, image_format, width, height, scale)
+        path = self.image_path(key, image_format)
+
+        if os.path.exists(path):
+            # Image récente pour le nettoyage du cache
+            os.utime(path)
+            return key
+        if os.path.exists(f"{path}.error"):
+            os.remove(f"{path}.error")
+
+        with self.lock:
+            if self.executor is None:
+                self.executor = self.create_executor()
+            try:
+                self.executor.submit(render_image, fig_json, image_format, width, height, scale, path)
+            except BrokenProcessPool:
+                # Pool cassé par l'arrêt brutal d'un processus de rendu (plantage de kaleido, mémoire insuffisante) : création d'un nouveau pool
+                self.executor = self.create_executor()
+                self.executor.submit(render_image, fig_json, image_format, width, height, scale, path)
+        self.prune()
+        return key
+
+    # Fonction de création du pool, avec des processus démarrés indépendamment du serveur web
+    def create_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=start_renderer
+        )
+
+    # Fonction d'état d'un rendu : ("done", chemin), ("failed", message) ou ("pending", None)
+    def result(self, key, image_format, submitted=None):
+        path = self.image_path(key, image_format)
+        if os.path.exists(path):
+            return "done", path
+        if os.path.exists(f"{path}.error"):
+            with open(f"{path}.error", encoding="utf-8") as f:
+                return "failed", f.read()
+        if submitted is not None and time.time() - submitted > RENDER_TIMEOUT:
+            return "failed", "Délai de génération de l'image dépassé"
+        return "pending", None
+
+    # Fonction de suppression des images les moins récemment utilisées au-delà de la taille du cache
+    def prune(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                continue
+        for _, path in sorted(entries)[:max(len(entries) - self.max_entries, 0)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,140 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+# Niveau de zoom de la grille la plus fine de l'index
+BASE_ZOOM = 16
+
+# Nombre de cellules par tuile de 256 pixels, en puissance de 2 (2^3 = 8 cellules de 32 pixels)
+CELL_SHIFT = 3
+
+# Zoom à partir duquel les logements peuvent être affichés individuellement
+POINTS_MIN_ZOOM = 13
+
+# Nombre maximal de logements affichés individuellement, au-delà duquel ils sont regroupés
+MAP_POINT_BUDGET = int(os.environ.get("MAP_POINT_BUDGET", 20000))
+
+# Taille de la carte (en pixels) utilisée lorsque l'emprise affichée n'est pas connue
+DEFAULT_MAP_SIZE = (1200, 600)
+
+# Fonction de projection des coordonnées en coordonnées Web Mercator normalisées entre 0 et 1
+def project(lat, lon):
+    lat = np.clip(np.asarray(lat, dtype='float64'), -85.05112878, 85.05112878)
+    x = (np.asarray(lon, dtype='float64') + 180) / 360
+    y = (1 - np.log(np.tan(np.radians(lat)) + 1 / np.cos(np.radians(lat))) / np.pi) / 2
+    return x, y
+
+# Fonction de calcul de l'emprise (lon min, lat min, lon max, lat max) d'une carte à partir de son centre et de son zoom
+def viewport_bounds(center_lat, center_lon, zoom, size=DEFAULT_MAP_SIZE):
+    x, y = project(center_lat, center_lon)
+    half_width = size[0] / 2 / (256 * 2 ** zoom)
+    half_height = size[1] / 2 / (256 * 2 ** zoom)
+    lon_min, lon_max = (x - half_width) * 360 - 180, (x + half_width) * 360 - 180
+    lat_max = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y - half_height)))))
+    lat_min = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + half_height)))))
+    return float(lon_min), float(lat_min), float(lon_max), float(lat_max)
+
+class SpatialIndex:
+    """
+    Index spatial en grille des logements, trié par cellule, permettant de regrouper les logements selon le zoom
+    et de ne récupérer que ceux de l'emprise affichée
+    """
+
+    # Constructeur de la classe
+    def __init__(self, lat, lon, labels):
+        lat = pd.to_numeric(pd.Series(lat), errors='coerce').to_numpy(dtype='float64')
+        lon = pd.to_numeric(pd.Series(lon), errors='coerce').to_numpy(dtype='float64')
+        labels = pd.Categorical(labels)
+        valid = np.isfinite(lat) & np.isfinite(lon)
+
+        # Cellule de la grille la plus fine de chaque logement
+        x, y = project(lat[valid], lon[valid])
+        self.bits = BASE_ZOOM + CELL_SHIFT
+        cells = 1 << self.bits
+        cx = np.clip((x * cells).astype(np.int64), 0, cells - 1)
+        cy = np.clip((y * cells).astype(np.int64), 0, cells - 1)
+        keys = (cx << self.bits) | cy
+
+        # Tri des logements par cellule
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.cx, self.cy = cx[order], cy[order]
+        self.rows = np.flatnonzero(valid)[order]
+        self.lat, self.lon = lat[valid][order], lon[valid][order]
+        self.codes = labels.codes[valid][order]
+        self.categories = labels.categories
+        self.center = (float(np.mean(self.lat)), float(np.mean(self.lon))) if len(self.lat) else (45.75, 4.85)
+
+        self.clusters = {}
+        self.lock = threading.Lock()
+
+    # Fonction de conversion d'une emprise en plage de cellules de la grille la plus fine
+    def cell_range(self, bounds):
+        lon_min, lat_min, lon_max, lat_max = bounds
+        x_min, y_max = project(lat_min, lon_min)
+        x_max, y_min = project(lat_max, lon_max)
+        cells = 1 << self.bits
+        return (
+            int(np.clip(x_min * cells, 0, cells - 1)), int(np.clip(x_max * cells, 0, cells - 1)),
+            int(np.clip(y_min * cells, 0, cells - 1)), int(np.clip(y_max * cells, 0, cells - 1))
+        )
+
+    # Fonction de récupération des codes des étiquettes sélectionnées
+    def label_codes(self, labels):
+        if not labels:
+            return None
+        return [self.categories.get_loc(label) for label in labels if label in self.categories]
+
+    # Fonction de récupération des positions des logements d'une emprise, par recherche dichotomique colonne par colonne
+    def points(self, bounds, labels=None):
+        x0, x1, y0, y1 = self.cell_range(bounds)
+        columns = np.arange(x0, x1 + 1, dtype=np.int64) << self.bits
+        starts = np.searchsorted(self.keys, columns | y0, side='left')
+        ends = np.searchsorted(self.keys, columns | y1, side='right')
+        lengths = ends - starts
+        if lengths.sum() == 0:
+            return np.array([], dtype=np.int64)
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+        codes = self.label_codes(labels)
+        if codes is not None:
+            positions = positions[np.isin(self.codes[positions], codes)]
+        return positions
+
+    # Fonction de calcul des regroupements d'un niveau de zoom (effectif et position moyenne par cellule et par étiquette)
+    def clusters_at(self, zoom):
+        with self.lock:
+            if zoom not in self.clusters:
+                shift = BASE_ZOOM - zoom
+                cells = pd.DataFrame({
+                    'cx': self.cx >> shift,
+                    'cy': self.cy >> shift,
+                    'code': self.codes,
+                    'Latitude': self.lat,
+                    'Longitude': self.lon
+                })
+                grouped = cells.groupby(['cx', 'cy', 'code'])
+                clusters = grouped[['Latitude', 'Longitude']].mean()
+                clusters['Nombre de DPE'] = grouped.size()
+                self.clusters[zoom] = clusters.reset_index()
+            return self.clusters[zoom]
+
+    # Fonction de récupération des données à afficher : logements individuels si le zoom et leur nombre le permettent, regroupements sinon
+    def query(self, bounds, zoom, labels=None):
+        if zoom >= POINTS_MIN_ZOOM:
+            positions = self.points(bounds, labels)
+            if len(positions) <= MAP_POINT_BUDGET:
+                return 'points', self.rows[positions]
+
+        zoom = int(np.clip(np.floor(zoom), 0, BASE_ZOOM))
+        shift = BASE_ZOOM - zoom
+        x0, x1, y0, y1 = self.cell_range(bounds)
+        clusters = self.clusters_at(zoom)
+        mask = clusters['cx'].between(x0 >> shift, x1 >> shift) & clusters['cy'].between(y0 >> shift, y1 >> shift)
+        codes = self.label_codes(labels)
+        if codes is not None:
+            mask &= clusters['code'].isin(codes)
+        clusters = clusters[mask].copy()
+        clusters['Étiquette DPE'] = self.categories[clusters['code']]
+        return 'clusters', clusters.drop(columns=['cx', 'cy', 'code'])
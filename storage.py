@@ -0,0 +1,498 @@
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pandas.api.types import union_categoricals
+
+try:
+    import fcntl
+except ImportError:
+    # Verrous entre processus indisponibles (Windows, où gunicorn ne fonctionne pas) : un seul processus accède aux données
+    fcntl = None
+
+# Chemin des données sans extension
+DATA_PATH = "assets/data_69"
+
+# Fichier de version des données, écrit une seule fois par ingestion lorsque les données sont publiées
+VERSION_PATH = "var/data_69.version"
+
+# Verrou des opérations sur les données partagées entre les processus (conversion, colonnes projetées en mémoire)
+LOCK_PATH = "var/data_69.lock"
+
+# Format de stockage utilisé par défaut ("parquet" ou "csv")
+DEFAULT_BACKEND = os.environ.get("DATA_STORAGE", "parquet")
+
+# Nombre de fichiers Parquet au-delà duquel les derniers petits fichiers sont fusionnés lors d'un ajout
+PARQUET_MAX_PARTS = int(os.environ.get("DATA_MAX_PARTS", 16))
+
+# Nombre de lignes à partir duquel un fichier Parquet n'est plus fusionné avec les suivants
+PARQUET_PART_ROWS = 1000000
+
+# Dossier des colonnes projetées en mémoire et partagées entre les processus
+MAPPED_PATH = "var/data_69.columns"
+
+# Durée de conservation d'une génération de colonnes après son remplacement, le temps que les workers basculent (en secondes)
+GENERATION_GRACE = 600
+
+# Activation du partage des données en mémoire entre les workers gunicorn
+SHARED_MEMORY = os.environ.get("DATA_SHARED_MEMORY", "0") == "1"
+
+# Colonnes stockées sous forme catégorielle
+CATEGORY_COLUMNS = [
+    "Période construction",
+    "Type bâtiment",
+    "Type énergie chauffage",
+    "Type énergie ECS",
+    "Classe altitude",
+    "Étiquette DPE",
+    "Nom commune"
+]
+
+# Colonnes stockées sous forme numérique
+NUMERIC_COLUMNS = [
+    "Code postal",
+    "Date réception DPE",
+    "Date_réception_DPE_graph",
+    "Surface habitable logement",
+    "Nombre niveau logement",
+    "Hauteur sous-plafond",
+    "Consommation totale",
+    "Consommation chauffage",
+    "Consommation ECS",
+    "Latitude",
+    "Longitude"
+]
+
+# Types réduits des colonnes numériques pour le chargement compact des données
+COMPACT_DTYPES = {
+    "Code postal": "int32",
+    "Date réception DPE": "int32",
+    "Date_réception_DPE_graph": "int32",
+    "Nombre niveau logement": "int16",
+    "Surface habitable logement": "float32",
+    "Hauteur sous-plafond": "float32",
+    "Consommation totale": "float32",
+    "Consommation chauffage": "float32",
+    "Consommation ECS": "float32",
+    "Latitude": "float64",
+    "Longitude": "float64"
+}
+
+# Fonction d'application des types de colonnes
+def apply_dtypes(df):
+    df = df.copy()
+    for col in NUMERIC_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    return df
+
+# Fonction de réduction de la mémoire occupée par les données
+def compact_dtypes(df):
+    df = apply_dtypes(df)
+    for col, dtype in COMPACT_DTYPES.items():
+        if col not in df.columns:
+            continue
+        # Les colonnes entières contenant des valeurs manquantes sont converties en flottants
+        if dtype.startswith("int") and df[col].isna().any():
+            dtype = "float32"
+        df[col] = df[col].astype(dtype)
+    if "N°DPE" in df.columns:
+        df["N°DPE"] = df["N°DPE"].astype("string[pyarrow]")
+    return df
+
+# Fonction d'ajout de nouvelles lignes à des données déjà chargées, les catégories existantes gardant leurs codes
+def concat_data(df, delta):
+    delta = delta.reindex(columns=df.columns)
+    data = {}
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            new_values = pd.Index(delta[col].dropna().unique()).difference(df[col].cat.categories)
+            categories = df[col].cat.categories.append(new_values)
+            data[col] = union_categoricals([
+                df[col].cat.set_categories(categories),
+                pd.Categorical(delta[col], categories=categories)
+            ])
+        else:
+            data[col] = pd.concat([df[col], delta[col]], ignore_index=True)
+    return pd.DataFrame(data)
+
+# Fonction de lecture du fichier de version des données
+def read_version(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+# Fonction d'écriture d'une nouvelle version des données : le numéro augmente à chaque publication
+# et la base change lorsque les données ont été réécrites entièrement
+def write_version(path, rewrite):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    current = read_version(path)
+    base = uuid.uuid4().hex[:12] if rewrite or current is None else current["base"]
+    number = current["number"] + 1 if current is not None else 1
+    tmp_path = tmp_name(path)
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"base": base, "number": number}, f)
+    os.replace(tmp_path, path)
+
+# Fonction de verrouillage exclusif entre processus, les autres processus attendant la fin de l'opération
+@contextmanager
+def file_lock(path=LOCK_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+# Fonction de nom de fichier temporaire propre au processus et à l'écriture
+def tmp_name(path):
+    return f"{path}.{os.getpid()}-{uuid.uuid4().hex[:8]}.tmp"
+
+# Fonction de calcul de la mémoire occupée par chaque colonne (en Mo)
+def memory_report(df):
+    return (df.memory_usage(index=False, deep=True) / 1024 ** 2).round(2)
+
+class CsvStorage:
+    """
+    Stockage des données dans un fichier CSV délimité par des "|"
+    """
+
+    # Constructeur de la classe
+    def __init__(self, path=DATA_PATH, version_path=VERSION_PATH):
+        self.path = f"{path}.csv"
+        self.version_path = version_path
+
+    # Fonction de vérification de l'existence des données
+    def exists(self):
+        return os.path.exists(self.path)
+
+    # Fonction de récupération des noms des colonnes
+    def columns(self):
+        return pd.read_csv(self.path, sep="|", nrows=0).columns.tolist()
+
+    # Fonction de récupération de la signature des données, modifiée à chaque écriture
+    def signature(self):
+        stat = os.stat(self.path)
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    # Fonction de récupération de la version des données
+    def version(self):
+        return read_version(self.version_path)
+
+    # Fonction de publication d'une nouvelle version des données, une fois leur ingestion terminée :
+    # les écritures intermédiaires ne changent pas la version et ne provoquent pas de rechargement des workers
+    def publish(self, rewrite):
+        write_version(self.version_path, rewrite)
+
+    # Fonction de chargement des données
+    def load(self, columns=None, compact=False):
+        df = pd.read_csv(self.path, sep="|", usecols=columns)
+        return compact_dtypes(df) if compact else apply_dtypes(df)
+
+    # Fonction de chargement des lignes ajoutées après les premières lignes déjà chargées
+    def load_delta(self, rows, compact=False):
+        df = pd.read_csv(self.path, sep="|", skiprows=range(1, rows + 1))
+        return compact_dtypes(df) if compact else apply_dtypes(df)
+
+    # Fonction de sauvegarde complète des données
+    def save(self, df):
+        tmp_path = tmp_name(self.path)
+        df.to_csv(tmp_path, index=False, sep="|", encoding="utf-8")
+        os.replace(tmp_path, self.path)
+
+    # Fonction d'ajout de nouvelles données
+    def append(self, df):
+        df = df.reindex(columns=self.columns())
+        df.to_csv(self.path, index=False, sep="|", encoding="utf-8", mode="a", header=False)
+
+class ParquetStorage:
+    """
+    Stockage des données au format Parquet, dans un dossier contenant un fichier par ajout
+    """
+
+    # Constructeur de la classe
+    def __init__(self, path=DATA_PATH, version_path=VERSION_PATH):
+        self.path = f"{path}.parquet"
+        self.version_path = version_path
+
+    # Fonction de récupération des fichiers de données, dans l'ordre d'écriture
+    def parts(self):
+        if not os.path.isdir(self.path):
+            return []
+        return [os.path.join(self.path, name) for name in sorted(os.listdir(self.path)) if name.endswith(".parquet")]
+
+    # Fonction de vérification de l'existence des données
+    def exists(self):
+        return len(self.parts()) > 0
+
+    # Fonction de récupération des noms des colonnes
+    def columns(self):
+        return pq.read_schema(self.parts()[0]).names
+
+    # Fonction de récupération de la signature des données, modifiée à chaque écriture
+    def signature(self):
+        return ",".join(os.path.basename(part) for part in self.parts())
+
+    # Fonction de récupération de la version des données
+    def version(self):
+        return read_version(self.version_path)
+
+    # Fonction de publication d'une nouvelle version des données, une fois leur ingestion terminée :
+    # les écritures intermédiaires ne changent pas la version et ne provoquent pas de rechargement des workers
+    def publish(self, rewrite):
+        write_version(self.version_path, rewrite)
+
+    # Fonction de chargement des données
+    def load(self, columns=None, compact=False):
+        parts = self.parts()
+        if not parts:
+            raise FileNotFoundError(self.path)
+        df = pd.concat([pd.read_parquet(part, columns=columns) for part in parts], ignore_index=True)
+        return compact_dtypes(df) if compact else apply_dtypes(df)
+
+    # Fonction de chargement des lignes ajoutées après les premières lignes déjà chargées, sans relire les fichiers déjà chargés
+    def load_delta(self, rows, compact=False):
+        frames, offset = [], 0
+        for part in self.parts():
+            part_rows = pq.ParquetFile(part).metadata.num_rows
+            if offset + part_rows > rows:
+                frames.append(pd.read_parquet(part).iloc[max(rows - offset, 0):])
+            offset += part_rows
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=self.columns())
+        return compact_dtypes(df) if compact else apply_dtypes(df)
+
+    # Fonction d'écriture d'un fichier de données
+    def write_part(self, df, index):
+        os.makedirs(self.path, exist_ok=True)
+        part_path = os.path.join(self.path, f"part-{index:05d}.parquet")
+        tmp_path = tmp_name(part_path)
+        apply_dtypes(df).to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, part_path)
+
+    # Fonction du numéro du prochain fichier de données
+    def next_index(self, parts):
+        return int(os.path.basename(parts[-1])[5:10]) + 1 if parts else 0
+
+    # Fonction de sauvegarde complète des données : les anciens fichiers ne sont supprimés qu'une fois le nouveau écrit
+    def save(self, df):
+        parts = self.parts()
+        self.write_part(df, self.next_index(parts))
+        for part in parts:
+            os.remove(part)
+
+    # Fonction d'ajout de nouvelles données
+    def append(self, df):
+        parts = self.parts()
+        if not parts:
+            self.save(df)
+            return
+        df = df.reindex(columns=self.columns())
+        self.write_part(df, self.next_index(parts))
+        self.compact()
+
+    # Fonction de fusion des derniers petits fichiers lorsque les ajouts successifs ont créé trop de fichiers :
+    # les fichiers fusionnés étant les derniers, l'ordre et la position des lignes ne changent pas
+    def compact(self, max_parts=PARQUET_MAX_PARTS, part_rows=PARQUET_PART_ROWS):
+        parts = self.parts()
+        if len(parts) <= max_parts:
+            return
+        small = []
+        for part in reversed(parts):
+            if pq.ParquetFile(part).metadata.num_rows >= part_rows:
+                break
+            small.insert(0, part)
+        if len(small) < 2:
+            return
+        self.write_part(pd.concat([pd.read_parquet(part) for part in small], ignore_index=True), self.next_index(parts))
+        for part in small:
+            os.remove(part)
+
+class MappedColumns:
+    """
+    Colonnes des données écrites une seule fois sous forme de fichiers projetés en mémoire (mmap),
+    que chaque worker ouvre en lecture seule afin de partager le cache de pages du système
+    """
+
+    # Constructeur de la classe
+    def __init__(self, path=MAPPED_PATH):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+
+    # Fonction de récupération du dossier de la génération courante
+    def current(self):
+        try:
+            with open(os.path.join(self.path, "CURRENT"), encoding="utf-8") as f:
+                return os.path.join(self.path, f.read().strip())
+        except FileNotFoundError:
+            return None
+
+    # Fonction de lecture de la description des colonnes d'une génération (la génération courante par défaut),
+    # None si elle n'existe pas ou plus
+    def meta(self, current=None):
+        current = current or self.current()
+        if current is None:
+            return None
+        try:
+            with open(os.path.join(current, "meta.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            # Fichier CURRENT pointant vers une génération supprimée : les colonnes sont à reconstruire
+            return None
+
+    # Fonction de vérification de la correspondance avec les données stockées
+    def is_up_to_date(self, storage):
+        meta = self.meta()
+        return meta is not None and meta["source"] == storage.signature()
+
+    # Fonction d'écriture d'une nouvelle génération de colonnes, à appeler sous le verrou
+    def write(self, df, source):
+        df = compact_dtypes(df)
+        generation = f"gen-{uuid.uuid4().hex[:12]}"
+        gen_path = os.path.join(self.path, generation)
+        os.makedirs(gen_path)
+
+        columns = []
+        for i, col in enumerate(df.columns):
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                file = f"col-{i:03d}.npy"
+                np.save(os.path.join(gen_path, file), df[col].cat.codes.to_numpy())
+                columns.append({"name": col, "kind": "category", "file": file, "categories": df[col].cat.categories.tolist()})
+            elif pd.api.types.is_numeric_dtype(df[col]):
+                file = f"col-{i:03d}.npy"
+                np.save(os.path.join(gen_path, file), df[col].to_numpy())
+                columns.append({"name": col, "kind": "numeric", "file": file})
+            else:
+                # Les chaînes de caractères sont écrites au format Arrow pour être lues sans copie
+                file = f"col-{i:03d}.arrow"
+                table = pa.table({"values": pa.array(df[col].astype(object).where(df[col].notna(), None), type=pa.large_string())})
+                with pa.OSFile(os.path.join(gen_path, file), "wb") as f:
+                    with pa.ipc.new_file(f, table.schema) as writer:
+                        writer.write_table(table)
+                columns.append({"name": col, "kind": "string", "file": file})
+
+        with open(os.path.join(gen_path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"source": source, "rows": len(df), "columns": columns}, f, ensure_ascii=False)
+
+        # Bascule atomique vers la nouvelle génération, l'ancienne étant conservée le temps que les workers basculent
+        previous = self.current()
+        tmp_path = tmp_name(os.path.join(self.path, "CURRENT"))
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(generation)
+        os.replace(tmp_path, os.path.join(self.path, "CURRENT"))
+        self.cleanup(generation, previous)
+
+    # Fonction de suppression des générations remplacées depuis plus de GENERATION_GRACE secondes
+    # (les workers qui les projettent encore en mémoire gardent leur accès)
+    def cleanup(self, generation, previous=None):
+        retired_path = os.path.join(self.path, "retired.json")
+        try:
+            with open(retired_path, encoding="utf-8") as f:
+                retired = json.load(f)
+        except FileNotFoundError:
+            retired = {}
+        if previous is not None:
+            retired[os.path.basename(previous)] = time.time()
+
+        kept = {}
+        for name in os.listdir(self.path):
+            if not name.startswith("gen-") or name == generation:
+                continue
+            # Les générations inconnues (écriture interrompue) sont datées de leur création
+            retired_at = retired.get(name, os.path.getmtime(os.path.join(self.path, name)))
+            if time.time() - retired_at > GENERATION_GRACE:
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+            else:
+                kept[name] = retired_at
+
+        tmp_path = tmp_name(retired_path)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(kept, f)
+        os.replace(tmp_path, retired_path)
+
+    # Fonction de projection en mémoire des colonnes d'une génération
+    def read(self, current, meta):
+        data = {}
+        for column in meta["columns"]:
+            file_path = os.path.join(current, column["file"])
+            if column["kind"] == "category":
+                codes = np.load(file_path, mmap_mode="r")
+                data[column["name"]] = pd.Categorical.from_codes(codes, categories=column["categories"], validate=False)
+            elif column["kind"] == "numeric":
+                data[column["name"]] = np.load(file_path, mmap_mode="r")
+            else:
+                table = pa.ipc.open_file(pa.memory_map(file_path, "r")).read_all()
+                data[column["name"]] = pd.arrays.ArrowStringArray(table.column("values"))
+        return pd.DataFrame(data, copy=False)
+
+    # Fonction de projection en mémoire des colonnes de la génération courante, None s'il n'y en a pas
+    def load(self, attempts=3):
+        for attempt in range(attempts):
+            current = self.current()
+            meta = self.meta(current)
+            if meta is None:
+                return None
+            try:
+                return self.read(current, meta)
+            except FileNotFoundError:
+                # Génération remplacée et supprimée pendant la lecture : lecture de la nouvelle génération courante
+                if attempt == attempts - 1:
+                    raise
+
+    # Fonction de construction des colonnes si les données stockées ont changé, par un seul processus à la fois
+    def refresh(self, storage):
+        if self.is_up_to_date(storage):
+            return
+        with file_lock(self.lock_path):
+            if not self.is_up_to_date(storage):
+                self.write(storage.load(compact=True), storage.signature())
+
+# Fonction de chargement des données pour l'interface, partagées en mémoire si le mode est activé :
+# les colonnes sont construites au démarrage ou lors de l'ingestion ("build"), jamais lors d'un rechargement
+def load_data(storage, build=True):
+    if SHARED_MEMORY:
+        mapped = MappedColumns()
+        if build:
+            mapped.refresh(storage)
+        df = mapped.load()
+        if df is not None:
+            return df
+    return storage.load(compact=True)
+
+# Fonction de récupération du stockage des données (l'ancien fichier CSV tant qu'il n'a pas été converti)
+def get_storage(backend=DEFAULT_BACKEND, path=DATA_PATH):
+    if backend == "csv":
+        return CsvStorage(path)
+
+    storage = ParquetStorage(path)
+    legacy = CsvStorage(path)
+    if not storage.exists() and legacy.exists():
+        return legacy
+    return storage
+
+# Fonction de conversion unique de l'ancien fichier CSV au format Parquet, effectuée par un seul processus :
+# les autres attendent la fin de la conversion sous le verrou puis trouvent les données converties
+def migrate_storage(backend=DEFAULT_BACKEND, path=DATA_PATH):
+    if backend == "csv":
+        return
+    storage = ParquetStorage(path)
+    legacy = CsvStorage(path)
+    if storage.exists() or not legacy.exists():
+        return
+    with file_lock():
+        if not storage.exists():
+            print("Conversion des données au format Parquet...")
+            storage.save(legacy.load())